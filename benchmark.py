@@ -0,0 +1,294 @@
+"""
+Offline benchmarks for the bot's command hot paths.
+
+Drives the command coroutines with a stub context that records send() calls,
+against a generated fixture kjv.sqlite and the bundled lexicons, so no Discord
+connection is needed.
+
+    python benchmark.py                        run every scenario and print a report
+    python benchmark.py -n 500 strongs bible   run selected scenarios
+    python benchmark.py --save baseline.json   store the results as a baseline
+    python benchmark.py --compare baseline.json [--tolerance 0.2] [--min-delta 0.05]
+                                               exit non-zero if p50/p95 regressed
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import io
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import build_verse_strongs
+import database
+import response_cache
+import workers
+
+# A few real verses, repeated through the fixture so -strongs has realistic words to match
+FIXTURE_TEXT = (
+    "In the beginning God created the heaven and the earth.",
+    "For God so loved the world, that he gave his only begotten Son, that whosoever believeth in him should not perish, but have everlasting life.",
+    "The LORD is my shepherd; I shall not want.",
+    "It is the glory of God to conceal a thing: but the honour of kings is to search out a matter.",
+    "Charity suffereth long, and is kind; charity envieth not; charity vaunteth not itself, is not puffed up,",
+)
+FIXTURE_CHAPTERS = 5
+FIXTURE_VERSES = 40
+FIXTURE_THREADS = 200
+
+
+def build_fixture_kjv(path):
+    """
+    Create a kjv.sqlite with the same schema as the real one and a few chapters per book.
+    """
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("CREATE TABLE verses (id INTEGER PRIMARY KEY, book INTEGER, chapter INTEGER, verse INTEGER, text TEXT)")
+        conn.executemany(
+            "INSERT INTO verses (book, chapter, verse, text) VALUES (?, ?, ?, ?)",
+            (
+                (book, chapter, verse, FIXTURE_TEXT[(book + chapter + verse) % len(FIXTURE_TEXT)])
+                for book in range(1, 67)
+                for chapter in range(1, FIXTURE_CHAPTERS + 1)
+                for verse in range(1, FIXTURE_VERSES + 1)
+            )
+        )
+    conn.close()
+
+
+class FakeUser:
+    def __init__(self, user_id, name):
+        self.id = user_id
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+
+class FakeThread:
+    def __init__(self, thread_id):
+        self.id = thread_id
+        self.name = f"thread-{thread_id}"
+        self.owner = FakeUser(thread_id * 7, f"owner-{thread_id}")
+        self.created_at = datetime.datetime(2024, 1, 1)
+
+
+class FakeChannel:
+    def __init__(self, threads):
+        self.id = 1
+        self.threads = threads
+        self.mention = "#benchmark"
+
+
+class FakeContext:
+    """
+    Stand-in for commands.Context that records everything the command sends.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.author = FakeUser(1, "benchmark")
+        self.guild = None
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content)
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def scenarios(bot_module):
+    """
+    name -> coroutine function taking a FakeContext
+    """
+    return {
+        "strongs": lambda ctx: bot_module.strongs.callback(ctx, strongs_number="G26"),
+        "search_strongs": lambda ctx: bot_module.search_strongs(ctx, "love"),
+        "strongs_tree": lambda ctx: bot_module.strongs.callback(ctx, strongs_number="tree H1254 3"),
+        "strongs_verses": lambda ctx: bot_module.strongs.callback(ctx, strongs_number="verses G26"),
+        "bible": lambda ctx: bot_module.bible.callback(ctx, reference="john 3:1-36"),
+        "bible_strongs": lambda ctx: bot_module.bible.callback(ctx, reference="-strongs john 3:16-21"),
+        "concordance": lambda ctx: bot_module.concordance_search.callback(ctx, query='"my shepherd" -in psalms'),
+        "annotate_with_strongs": lambda ctx: _annotate_in_process(),
+        "listthreads": lambda ctx: bot_module.listthreads.callback(ctx, None),
+    }
+
+
+async def _annotate_in_process():
+    # Measures the annotation itself, without the process pool round trip
+    workers.annotate_verses(FIXTURE_TEXT)
+
+
+async def run_scenario(name, make_call, channel, iterations, warmup):
+    for _ in range(warmup):
+        await make_call(FakeContext(channel))
+
+    timings = []
+    sends = 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        ctx = FakeContext(channel)
+        t0 = time.perf_counter()
+        await make_call(ctx)
+        timings.append(time.perf_counter() - t0)
+        sends += len(ctx.sent)
+    elapsed = time.perf_counter() - start
+
+    # Memory is measured on a separate pass so tracing doesn't skew the timings: the
+    # peak traced memory during each call, above what was in use when it started.
+    # Work done in the worker processes isn't traced
+    alloc_runs = min(iterations, 20)
+    peaks = []
+    tracemalloc.start()
+    for _ in range(alloc_runs):
+        ctx = FakeContext(channel)
+        tracemalloc.reset_peak()
+        in_use, _ = tracemalloc.get_traced_memory()
+        await make_call(ctx)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - in_use)
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "iterations": iterations,
+        "p50_ms": percentile(timings, 0.50) * 1000,
+        "p95_ms": percentile(timings, 0.95) * 1000,
+        "p99_ms": percentile(timings, 0.99) * 1000,
+        "mean_ms": statistics.fmean(timings) * 1000,
+        "throughput_per_s": iterations / elapsed if elapsed else 0.0,
+        "sends_per_call": sends / iterations,
+        "peak_alloc_bytes_per_call": statistics.fmean(peaks),
+    }
+
+
+def print_report(results):
+    header = f"{'scenario':<22}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}{'peak KiB':>10}{'sends':>7}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        print(f"{name:<22}{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}{r['p99_ms']:>10.3f}"
+              f"{r['throughput_per_s']:>10.1f}{r['peak_alloc_bytes_per_call'] / 1024:>10.1f}{r['sends_per_call']:>7.1f}")
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """
+    Return a list of regression descriptions, empty if everything is within tolerance.
+
+    Slowdowns smaller than min_delta_ms are ignored so timer noise on
+    microsecond-scale commands isn't reported as a regression.
+    """
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            if r[metric] > base[metric] * (1 + tolerance) and r[metric] - base[metric] > min_delta_ms:
+                regressions.append(
+                    f"{name} {metric}: {r[metric]:.3f} ms vs baseline {base[metric]:.3f} ms "
+                    f"(+{(r[metric] / base[metric] - 1) * 100 if base[metric] else 100:.0f}%)"
+                )
+    return regressions
+
+
+async def main_async(args):
+    fixture_dir = tempfile.TemporaryDirectory()
+    kjv_path = args.kjv or os.path.join(fixture_dir.name, "kjv.sqlite")
+    if not args.kjv:
+        build_fixture_kjv(kjv_path)
+        # Precomputed -strongs tags, as build_verse_strongs.py stores them
+        conn = sqlite3.connect(kjv_path)
+        build_verse_strongs.build(conn, build_verse_strongs.heuristic_source(conn), database.TAGS_FROM_HEURISTIC)
+        conn.close()
+    threads_path = os.path.join(fixture_dir.name, "threads.db")
+
+    # Point the shared data layer at the fixtures before the bot module uses it
+    database.kjv_db = database.Database(kjv_path, workers=4)
+    database.threads_db = database.Database(threads_path, workers=1)
+    database.thread_ratings = database.ThreadRatings(database.threads_db)
+
+    # Keep the response cache off disk, and out of the way unless asked for
+    os.environ["RESPONSE_CACHE_PATH"] = ""
+    with contextlib.redirect_stdout(io.StringIO()):
+        import bot as bot_module
+        bot_module.setup()
+    if not args.response_cache:
+        bot_module.responses = response_cache.ResponseCache(max_bytes=0)
+
+    channel = FakeChannel([FakeThread(i) for i in range(1, FIXTURE_THREADS + 1)])
+    for thread in channel.threads[::2]:
+        await database.threads_db.execute(
+            "INSERT OR REPLACE INTO thread_info (thread_id, thread_name, owner_id, rating) VALUES (?, ?, ?, ?)",
+            (thread.id, thread.name, thread.owner.id, thread.id % 5 + 1)
+        )
+
+    await bot_module.verse_concordance.build()
+
+    # In-process copy of the worker state for the annotate_with_strongs scenario
+    workers._init_worker()
+    await bot_module.lexicon_workers.warm_up()
+
+    available = scenarios(bot_module)
+    selected = args.scenarios or list(available)
+    unknown = [name for name in selected if name not in available]
+    if unknown:
+        raise SystemExit(f"Unknown scenario(s): {', '.join(unknown)}. Choose from: {', '.join(available)}")
+
+    results = {}
+    try:
+        for name in selected:
+            with contextlib.redirect_stdout(io.StringIO()):
+                results[name] = await run_scenario(name, available[name], channel, args.iterations, args.warmup)
+    finally:
+        bot_module.lexicon_workers.shutdown()
+        database.kjv_db.close()
+        database.threads_db.close()
+        fixture_dir.cleanup()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bot's command hot paths offline.")
+    parser.add_argument("scenarios", nargs="*", help="scenarios to run (default: all)")
+    parser.add_argument("-n", "--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--response-cache", action="store_true", help="leave the response cache on (measures cache hits)")
+    parser.add_argument("--kjv", help="use this kjv.sqlite instead of the generated fixture")
+    parser.add_argument("--save", metavar="PATH", help="write results to PATH as a baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare against the baseline at PATH")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before failing (default 0.2 = 20%%)")
+    parser.add_argument("--min-delta", type=float, default=0.05, help="ignore slowdowns below this many ms (default 0.05)")
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+    print_report(results)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_delta)
+        if regressions:
+            print("Performance regressions:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
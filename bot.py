@@ -1,61 +1,319 @@
+import time
+STARTUP_BEGAN = time.perf_counter()
+
 import discord
-import sqlite3
 import asyncio
 import json
-import nltk
-nltk.download('wordnet')
-nltk.download('averaged_perceptron_tagger')
-from nltk.stem import WordNetLemmatizer
+import logging
+import os
 
 from discord.ext import commands
 
+import concordance
+import lexicon
+import database
+import message_index
+import output
+import polls
+import references
+import response_cache
+import scheduler
+import workers
+from database import threads_db
+from metrics import registry, SampleFilter, start_http_server
+
+# Logging: LOG_LEVEL sets the level, LOG_SAMPLE_RATE is the fraction of debug records kept
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+log = logging.getLogger("bot")
+log.addFilter(SampleFilter(float(os.environ.get("LOG_SAMPLE_RATE", "0.01"))))
+
+# Optional Prometheus/JSON metrics endpoint, e.g. METRICS_PORT=9108
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = os.environ.get("METRICS_PORT")
+
 # Create the bot instance
 intents = discord.Intents.default()
 intents.guilds = True  # Enable guilds intent
 intents.members = True  # Enable member intent
 intents.messages = True  # Enable receiving messages
 intents.message_content = True  # Explicitly enable message content intent
-bot = commands.Bot(command_prefix="!", intents=intents)
 
-# Initialize the lemmatizer globally
-lemmatizer = WordNetLemmatizer()
+# Sharding: SHARD_COUNT is the total number of shards and SHARD_IDS the ones this
+# process runs, e.g. SHARD_COUNT=4 with SHARD_IDS=0,1 in one process and 2,3 in
+# another. Left unset, discord.py uses Discord's recommended count in one process.
+SHARD_COUNT = int(os.environ["SHARD_COUNT"]) if os.environ.get("SHARD_COUNT") else None
+SHARD_IDS = [int(shard) for shard in os.environ["SHARD_IDS"].split(",")] if os.environ.get("SHARD_IDS") else None
+
+
+def runs_guild(guild_id):
+    """
+    Whether this process runs the shard that receives guild_id's events. DMs go to shard 0.
+    """
+    if SHARD_IDS is None or SHARD_COUNT is None:
+        return True
+    return ((guild_id or 0) >> 22) % SHARD_COUNT in SHARD_IDS
+
+DEFAULT_PREFIX = "!"
+MAX_PREFIX_LENGTH = 5
+
+# Per-guild prefixes and thread ratings live in threads.db, shared by every
+# shard process; the change feed keeps each process's caches in sync with it
+guild_prefixes = database.GuildPrefixes(threads_db, DEFAULT_PREFIX)
+state_changes = database.ChangeFeed(threads_db)
+state_changes.subscribe("guild_prefixes", guild_prefixes.invalidate)
+state_changes.subscribe("thread_info", database.thread_ratings.invalidate)
+
+
+async def get_prefix(bot, message):
+    prefix = DEFAULT_PREFIX if message.guild is None else await guild_prefixes.get(message.guild.id)
+    # Mentioning the bot always works too, so a mistyped prefix can be undone with "@bot setprefix"
+    return commands.when_mentioned_or(prefix)(bot, message)
+
+
+# Commands and event handlers are collected by @command and @event and attached in
+# create_bot(), so importing this module (as every spawned worker process does)
+# doesn't build a bot
+_commands = []
+_events = []
+
+
+def command(*args, **kwargs):
+    """
+    Same as @command(), for the bot create_bot() builds later.
+    """
+    def register(callback):
+        cmd = commands.command(*args, **kwargs)(callback)
+        _commands.append(cmd)
+        return cmd
+    return register
+
+
+def event(callback):
+    _events.append(callback)
+    return callback
+
+
+# Built by setup()
+bot = None
+
+# Worker processes for Strong's search and -strongs annotation, each with its own lexicon copy
+lexicon_workers = workers.WorkerPool()
+
+BUSY_MESSAGE = "I'm handling a lot of requests right now, please try again in a moment."
+TIMEOUT_MESSAGE = "That request took too long to process, please try a smaller one."
+
+registry.gauge("bot_worker_pending_jobs", lambda: lexicon_workers.pending)
+
+# Finished responses for repeated !strongs / !bible lookups, opened by setup()
+responses = None
+
+# Most references and verses a single !bible request may ask for
+MAX_REFERENCES = 10
+MAX_VERSES = 200
+
+# Token cost of each command for the per-user and per-guild rate limits, 1 if
+# not listed. Commands costing scheduler.HEAVY_COST or more run in the heavy lane.
+COMMAND_COSTS = {"bible": 2, "concordance": 3, "listthreads": 3, "clear": 3, "poll": 2}
+# Arguments that make a command much more expensive than its usual cost
+ARGUMENT_COSTS = {
+    "bible": (("-strongs", 6),),
+    "strongs": (("search ", 4), ("verses ", 3), ("tree ", 2)),
+}
+# !bible costs a token per this many verses asked for, if that's more than its usual cost
+VERSES_PER_TOKEN = 20
+
+request_scheduler = scheduler.Scheduler()
+# Identical requests in flight at the same time share one response
+in_flight = scheduler.Coalescer()
+registry.gauge("bot_scheduler", lambda: [
+    ({"stat": name}, value) for name, value in request_scheduler.stats().items()
+] + [({"stat": "in_flight"}, len(in_flight))])
+
+
+def command_cost(ctx):
+    name = ctx.command.qualified_name
+    arguments = ctx.message.content.lower()
+    cost = COMMAND_COSTS.get(name, 1)
+    for marker, marker_cost in ARGUMENT_COSTS.get(name, ()):
+        if marker in arguments:
+            cost = max(cost, marker_cost)
+    if name == "bible":
+        # Long passages cost more, so whole books go through the heavy lane
+        try:
+            ranges = references.parse(ctx.kwargs.get("reference", "").replace("-strongs", ""))
+            cost = max(cost, sum(r.estimated_size() for r in ranges) // VERSES_PER_TOKEN)
+        except references.ReferenceParseError:
+            pass
+    return cost
+
+
+async def cached_response(command, build, *args, cache=True):
+    """
+    Messages for a command from the response cache, else from build(). While
+    one build is running, identical requests wait for it instead of starting
+    their own.
+    """
+    if cache:
+        messages = await responses.get(command, *args)
+        if messages is not None:
+            return messages
+
+    async def build_and_store():
+        messages = await build()
+        if cache:
+            await responses.put(command, messages, *args)
+        return messages
+
+    return await in_flight.run(response_cache.make_key(command, *args), build_and_store)
+
+
+# Poll votes are tallied from reaction events and checkpointed to threads.db. Each
+# process only tracks the polls of guilds on its own shards.
+poll_tracker = polls.PollTracker(threads_db, on_close=lambda result: post_poll_results(result),
+                                 owns_guild=runs_guild)
+
+# Ids of the bot's own messages and command messages per channel, for !clear
+recent_messages = message_index.MessageIndex()
+# Most messages one !clear looks at, the same for the index and the history purge
+MAX_CLEAR = message_index.CHANNEL_CAPACITY
+registry.gauge("bot_tracked_messages", lambda: len(recent_messages))
+
+# Keeps fire-and-forget tasks referenced until they finish
+background_tasks = set()
+
+# Full-text concordance over kjv.sqlite, built in the background once the bot is ready
+verse_concordance = concordance.create(database.kjv_db)
+CONCORDANCE_PAGE_SIZE = 20
+
+# Verses per page of !strongs verses, and a page past any number's last (the KJV
+# has 31,102 verses) so the offset stays well inside SQLite's integer range
+VERSES_PAGE_SIZE = 20
+MAX_VERSES_PAGE = 2000
+
+# Shown under Strong's tags that came from matching English words, not a tagged KJV
+GUESSED_TAGS_NOTICE = (
+    "*These tags are guesses made by matching English words to dictionary definitions, "
+    "not taken from a Strong's-tagged KJV, so many verses here may not contain this word.*"
+)
+
+# Default and largest number of hops !strongs tree follows in each direction
+TREE_HOPS = 2
+MAX_TREE_HOPS = 5
+
+# Seconds each startup phase took, exported as the bot_startup_seconds gauge
+startup_phases = {}
+registry.gauge("bot_startup_seconds", lambda: [({"phase": phase}, value) for phase, value in startup_phases.items()])
+
+# Filled in by load_lexicons() in the background while the gateway connects
+strongs_greek = strongs_hebrew = derivations = None
+lexicon_task = None
+
+
+def load_lexicons():
+    """
+    Open the Greek and Hebrew Strong's dictionaries and build the derivation graph (blocking).
+    """
+    global strongs_greek, strongs_hebrew, derivations
+    started = time.perf_counter()
+    try:
+        greek, hebrew = lexicon.load_dictionaries()
+        # Derivation links in both directions, for related numbers and !strongs tree
+        graph = lexicon.DerivationGraph([("G", greek), ("H", hebrew)])
+    except FileNotFoundError as e:
+        log.error("File not found: %s", e)
+        raise
+    except json.JSONDecodeError as e:
+        log.error("JSON decoding failed: %s", e)
+        raise
+    except Exception as e:
+        log.exception("An unexpected error occurred: %s", e)
+        raise
+    strongs_greek, strongs_hebrew, derivations = greek, hebrew, graph
+    startup_phases["lexicons"] = time.perf_counter() - started
+    log.info("Successfully loaded both dictionaries in %.2fs!", startup_phases["lexicons"])
+
+
+def start_loading_lexicons():
+    global lexicon_task
+    if lexicon_task is None:
+        lexicon_task = asyncio.ensure_future(asyncio.to_thread(load_lexicons))
+        lexicon_task.add_done_callback(_forget_failed_load)
+    return lexicon_task
+
 
-import sqlite3
+def _forget_failed_load(task):
+    # A failed load is retried by the next command rather than remembered forever
+    global lexicon_task
+    if lexicon_task is task and (task.cancelled() or task.exception() is not None):
+        lexicon_task = None
 
-try:
-    # Load the Greek Strong's dictionary
-    with open('strongs-greek-dictionary.json', 'r', encoding='utf-8') as f:
-        strongs_greek = json.load(f)
 
-    # Load the Hebrew Strong's dictionary
-    with open('strongs-hebrew-dictionary.json', 'r', encoding='utf-8') as f:
-        strongs_hebrew = json.load(f)
+async def lexicons_ready():
+    """
+    Wait for the dictionaries, starting the load if nothing has yet. Raises if loading failed.
+    """
+    await start_loading_lexicons()
+
+
+async def warm_up_workers():
+    started = time.perf_counter()
+    try:
+        # Compile the .lex files and word index once, here, before any worker
+        # starts; otherwise every worker would find them missing and build them too
+        await lexicons_ready()
+        await asyncio.to_thread(lexicon.load_word_index, strongs_greek, strongs_hebrew)
+        await lexicon_workers.warm_up()
+    except Exception as e:
+        log.error("Starting the worker processes failed, they'll be retried on the next request: %s", e)
+        return
+    startup_phases["workers"] = time.perf_counter() - started
+
 
-    print("Successfully loaded both dictionaries!")
-except FileNotFoundError as e:
-    print(f"File not found: {e}")
-except json.JSONDecodeError as e:
-    print(f"JSON decoding failed: {e}")
-except Exception as e:
-    print(f"An unexpected error occurred: {e}")
+async def setup_hook():
+    # Runs after login, before the gateway connects: everything slow starts
+    # here in the background instead of delaying the connection
+    start_loading_lexicons()
+    task = asyncio.create_task(warm_up_workers())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    verse_concordance.start()
 
     
 # Strong's lookup command
-@bot.command()
+@command()
 async def strongs(ctx, *, strongs_number: str):
     try:
-        print(f"Raw message received: '{strongs_number}'")
+        log.debug("Raw message received: '%s'", strongs_number)
 
         # Check if the command is a search query
         if strongs_number.lower().startswith("search "):
             search_keyword = strongs_number[len("search "):].strip()
-            print(f"Detected search query with keyword: '{search_keyword}'")
+            log.debug("Detected search query with keyword: '%s'", search_keyword)
             await search_strongs(ctx, search_keyword)
             return
 
-        # If not a search query, treat it as a Strong's number
+        if strongs_number.lower().startswith("verses "):
+            await strongs_verses(ctx, strongs_number[len("verses "):].split())
+            return
+
+        if strongs_number.lower().startswith("tree "):
+            await strongs_tree(ctx, strongs_number[len("tree "):].split())
+            return
+
+        await lexicons_ready()
+
+        # If not a search query, treat it as a Strong's number, "h08012" -> "H8012"
         strongs_number = strongs_number.upper().strip()  # Ensure uppercase and trim spaces
-        print(f"Looking up Strong's number: '{strongs_number}'")
+        strongs_number = lexicon.normalize_strongs_number(strongs_number) or strongs_number
+        log.debug("Looking up Strong's number: '%s'", strongs_number)
+
+        cached = await responses.get("strongs", strongs_number)
+        if cached is not None:
+            await output.send_messages(ctx, cached)
+            return
 
         # Direct lookup for Greek or Hebrew
         result = None
@@ -71,24 +329,10 @@ async def strongs(ctx, *, strongs_number: str):
         if result:
             transliteration = result.get('translit') or result.get('xlit', 'N/A')
 
-            # Extract related numbers from the derivation field
+            # Related numbers come from the precomputed derivation graph
             derivation = result.get('derivation', 'N/A')
-            related_numbers = []
-            if derivation != 'N/A':
-                related_numbers = [
-                    part.strip('()') for part in derivation.split()
-                    if part.startswith("G") or part.startswith("H")
-                ]
-            
-            # Format related numbers as clickable links
-            related_numbers_str = (
-    ", ".join(
-        f"[{num}](https://www.blueletterbible.org/lexicon/{num}/kjv/\u200b)"  # Add \u200b to disable embeds
-        for num in related_numbers
-    )
-    if related_numbers else "N/A"
-)
-
+            related_numbers = derivations.parents(strongs_number)
+            related_numbers_str = ", ".join(map(strongs_link, related_numbers)) if related_numbers else "N/A"
 
             # Construct the response
             response = (
@@ -100,16 +344,99 @@ async def strongs(ctx, *, strongs_number: str):
                 f"**Related Numbers**: {related_numbers_str}\n"
                 f"**KJV Definition**: {result.get('kjv_def', 'N/A')}"
             )
-            print(f"Sending response: {response}")
-            await ctx.send(response)
         else:
-            print(f"No result found for Strong's number: '{strongs_number}'")
-            await ctx.send(f"Sorry, Strong's number {strongs_number} not found.")
+            log.debug("No result found for Strong's number: '%s'", strongs_number)
+            response = f"Sorry, Strong's number {strongs_number} not found."
+
+        await responses.put("strongs", [response], strongs_number)
+        await ctx.send(response)
     except Exception as e:
-        print(f"An error occurred: {e}")
+        registry.inc("bot_command_errors_total", command="strongs")
+        log.exception("An error occurred: %s", e)
         await ctx.send("An error occurred while processing your request.")
 
-        
+
+def strongs_link(number):
+    # Add \u200b to disable embeds
+    return f"[{number}](https://www.blueletterbible.org/lexicon/{number}/kjv/\u200b)"
+
+
+async def strongs_tree(ctx, args):
+    """
+    !strongs tree G26 [hops]: the words a number derives from and the words
+    derived from it, up to `hops` steps away in each direction.
+    """
+    if not args or len(args) > 2 or (len(args) == 2 and not args[1].isdigit()):
+        await ctx.send("Usage: `!strongs tree <number> [hops]`, e.g. `!strongs tree G26 2`.")
+        return
+    strongs_number = lexicon.normalize_strongs_number(args[0])
+    if strongs_number is None:
+        await ctx.send("Invalid Strong's number. Please use 'G' for Greek or 'H' for Hebrew.")
+        return
+    hops = max(1, min(int(args[1]) if len(args) == 2 else TREE_HOPS, MAX_TREE_HOPS))
+    await lexicons_ready()
+
+    cached = await responses.get("strongs_tree", strongs_number, hops)
+    if cached is not None:
+        await output.send_messages(ctx, cached)
+        return
+
+    if strongs_number not in derivations:
+        messages = [f"Sorry, Strong's number {strongs_number} not found."]
+    else:
+        ancestors = derivations.ancestors(strongs_number, hops)
+        descendants = derivations.descendants(strongs_number, hops)
+        blocks = ["**Derived from**:"]
+        blocks += [f"{depth}. " + ", ".join(map(strongs_link, level)) for depth, level in enumerate(ancestors, 1)]
+        if not ancestors:
+            blocks.append("None")
+        blocks.append("**Derived words**:")
+        blocks += [f"{depth}. " + ", ".join(map(strongs_link, level)) for depth, level in enumerate(descendants, 1)]
+        if not descendants:
+            blocks.append("None")
+        header = f"**Strong's {strongs_number} derivation tree** ({hops} hop{'s' if hops != 1 else ''})"
+        messages = output.build_messages(blocks, header)
+
+    await responses.put("strongs_tree", messages, strongs_number, hops)
+    await output.send_messages(ctx, messages)
+
+
+async def strongs_verses(ctx, args):
+    """
+    !strongs verses G26 [page]: every verse tagged with a Strong's number,
+    from the precomputed verse_strongs table.
+    """
+    if not args or len(args) > 2 or (len(args) == 2 and not args[1].isdigit()):
+        await ctx.send("Usage: `!strongs verses <number> [page]`, e.g. `!strongs verses G26 2`.")
+        return
+    strongs_number = lexicon.normalize_strongs_number(args[0])
+    if strongs_number is None:
+        await ctx.send("Invalid Strong's number. Please use 'G' for Greek or 'H' for Hebrew.")
+        return
+    if not database.verse_strongs_available:
+        await ctx.send("Verse lookups by Strong's number aren't available yet.")
+        return
+    page = max(1, min(int(args[1]) if len(args) == 2 else 1, MAX_VERSES_PAGE))
+
+    async def build():
+        total, rows = await database.find_verses(strongs_number, VERSES_PAGE_SIZE, (page - 1) * VERSES_PAGE_SIZE)
+        pages = (total + VERSES_PAGE_SIZE - 1) // VERSES_PAGE_SIZE
+        if total == 0:
+            return [f"No verses found for {strongs_number}."]
+        if not rows:
+            return [f"There are only {pages} pages of verses for {strongs_number}."]
+        header = f"**Verses containing {strongs_link(strongs_number)}** ({total} verses, page {page}/{pages})"
+        if not database.verse_strongs_tagged:
+            header += "\n" + GUESSED_TAGS_NOTICE
+        blocks = (
+            f"{references.book_name(book)} {chapter}:{verse} - {text}" for book, chapter, verse, text in rows
+        )
+        return output.build_messages(blocks, header)
+
+    messages = await cached_response("strongs_verses", build, strongs_number, page)
+    await output.send_messages(ctx, messages)
+
+
 async def search_strongs(ctx, keyword: str):
     keyword = keyword.strip()
     filter_greek = "-g" in keyword
@@ -118,302 +445,463 @@ async def search_strongs(ctx, keyword: str):
     # Remove filter flags from the keyword
     keyword = keyword.replace("-g", "").replace("-h", "").strip()
 
-    results = []
-
-    # Search Greek dictionary if no filter or Greek filter is applied
-    if not filter_hebrew or filter_greek:
-        for number, entry in strongs_greek.items():
-            if keyword.lower() in entry.get('lemma', '').lower() or \
-               keyword.lower() in entry.get('translit', '').lower() or \
-               keyword.lower() in entry.get('strongs_def', '').lower() or \
-               keyword.lower() in entry.get('kjv_def', '').lower():  # Added `kjv_def` check
-                results.append(
-                    f"**[{number}](https://www.blueletterbible.org/lexicon/{number}/kjv/\u200b)**\n"
-                    f"**Lemma**: {entry.get('lemma', 'N/A')}\n"
-                    f"**Transliteration**: {entry.get('translit', 'N/A')}\n"
-                    f"**Definition**: {entry.get('strongs_def', 'N/A')}\n"
-                    f"**Derivation**: {entry.get('derivation', 'N/A')}\n"
-                    f"**KJV Definition**: {entry.get('kjv_def', 'N/A')}\n"
-                )
-
-    # Search Hebrew dictionary if no filter or Hebrew filter is applied
-    if not filter_greek or filter_hebrew:
-        for number, entry in strongs_hebrew.items():
-            if keyword.lower() in entry.get('lemma', '').lower() or \
-               keyword.lower() in entry.get('xlit', '').lower() or \
-               keyword.lower() in entry.get('strongs_def', '').lower() or \
-               keyword.lower() in entry.get('kjv_def', '').lower():  # Added `kjv_def` check
-                results.append(
-                    f"**[{number}](https://www.blueletterbible.org/lexicon/{number}/kjv/\u200b)**\n"
-                    f"**Lemma**: {entry.get('lemma', 'N/A')}\n"
-                    f"**Transliteration**: {entry.get('xlit', 'N/A')}\n"
-                    f"**Definition**: {entry.get('strongs_def', 'N/A')}\n"
-                    f"**Derivation**: {entry.get('derivation', 'N/A')}\n"
-                    f"**KJV Definition**: {entry.get('kjv_def', 'N/A')}\n"
-                )
-
-    # Debug the results
-    print(f"Results before sending: {results}")
-
-    # Send the results or handle large messages
-    if results:
-        message = "\n".join(results[:10])  # Limit to 10 results
-        print(f"Message length: {len(message)}")
-        try:
-            if len(message) > 2000:
-                chunks = [message[i:i + 2000] for i in range(0, len(message), 2000)]
-                for chunk in chunks:
-                    await ctx.send(chunk)
-            else:
-                await ctx.send(message)
-        except Exception as e:
-            print(f"Error sending message: {e}")
-    else:
-        await ctx.send(f"No results found for '{keyword}'.")
+    # Search both dictionaries unless exactly one filter is applied
+    languages = None
+    if filter_greek and not filter_hebrew:
+        languages = {"G"}
+    elif filter_hebrew and not filter_greek:
+        languages = {"H"}
+
+    async def build():
+        # Ranked lookup in the inverted index, only the top 10 hits are returned
+        total, results = await lexicon_workers.submit(workers.search, keyword, languages, 10)
+        log.debug("Search for '%s' matched %d entries", keyword, total)
+
+        # Pack the results on result boundaries
+        if results:
+            return output.build_messages(results)
+        return [f"No results found for '{keyword}'."]
+
+    try:
+        messages = await cached_response(
+            "search_strongs", build, keyword.lower(), sorted(languages) if languages else None
+        )
+    except workers.WorkerPoolBusy:
+        await ctx.send(BUSY_MESSAGE)
+        return
+    except asyncio.TimeoutError:
+        await ctx.send(TIMEOUT_MESSAGE)
+        return
+
+    try:
+        await output.send_messages(ctx, messages)
+    except Exception as e:
+        log.warning("Error sending message: %s", e)
         
 
-@bot.command()
+@command()
 async def bible(ctx, *, reference: str):
     try:
-        print(f"Raw message received: '{reference}'")
+        log.debug("Raw message received: '%s'", reference)
         use_strongs = "-strongs" in reference
         reference = reference.replace("-strongs", "").strip().lower()
 
-        if ' ' not in reference:
-            await ctx.send("Invalid reference format. Use BOOK CHAPTER:VERSE or BOOK CHAPTER:VERSE-VERSE.")
+        # Resolve book names/abbreviations and every reference in the message to verse ranges
+        try:
+            ranges = references.parse(reference)
+        except references.ReferenceParseError as e:
+            await ctx.send(str(e))
+            return
+
+        if len(ranges) > MAX_REFERENCES:
+            await ctx.send(f"Please ask for at most {MAX_REFERENCES} references at a time.")
             return
 
-        parts = reference.split(' ', 1)
-        book = parts[0]
-        chapter_verse = parts[1]
+        async def build():
+            # Explicit verse ranges are sized exactly (missing verses are listed too);
+            # whole chapters are counted from the index, before anything is fetched
+            explicit = [r for r in ranges if r.single_chapter and r.end_verse != references.LAST_VERSE]
+            spans = [r for r in ranges if r not in explicit]
+            size = sum(r.estimated_size() for r in explicit)
+            if spans and size <= MAX_VERSES:
+                size += await database.count_verse_ranges(spans)
+            if size > MAX_VERSES:
+                return [f"That's more than {MAX_VERSES} verses, please narrow the range."]
+
+            # Single-chapter ranges come from the chapter cache, the rest in one query
+            rows = await database.get_verse_ranges(ranges)
+
+            if use_strongs and database.verse_strongs_available:
+                # Precomputed tags: text and tags for every range in one joined query
+                tagged = await database.get_tagged_verse_ranges(ranges)
+                rows = [
+                    [(chapter, verse, workers.render_annotated(text, tags)) for chapter, verse, text, tags in verses]
+                    for verses in tagged
+                ]
+
+            texts = [text for verses in rows for _, _, text in verses]
+            if use_strongs and texts and not database.verse_strongs_available:
+                # Annotate every verse in a single worker job
+                annotated = iter(await lexicon_workers.submit(workers.annotate_verses, texts))
+                rows = [[(chapter, verse, next(annotated)) for chapter, verse, _ in verses] for verses in rows]
+
+            blocks = []
+            for verse_range, verses in zip(ranges, rows):
+                name = references.book_name(verse_range.book)
+                found = {(chapter, verse): text for chapter, verse, text in verses}
+
+                if verse_range.single_chapter and verse_range.end_verse != references.LAST_VERSE:
+                    # An explicit verse range: show which verses are missing
+                    chapter = verse_range.start_chapter
+                    for verse in range(verse_range.start_verse, verse_range.end_verse + 1):
+                        text = found.get((chapter, verse), "Verse not found!")
+                        blocks.append(f"{name} {chapter}:{verse} - {text}")
+                elif verses:
+                    for chapter, verse, text in verses:
+                        blocks.append(f"{name} {chapter}:{verse} - {text}")
+                else:
+                    blocks.append(f"{verse_range.label()} - Verse not found!")
+            guessed = use_strongs and not database.verse_strongs_tagged
+            return output.build_messages(blocks, GUESSED_TAGS_NOTICE if guessed else "")
 
-        if ':' not in chapter_verse:
-            await ctx.send("Invalid reference format. Use BOOK CHAPTER:VERSE or BOOK CHAPTER:VERSE-VERSE.")
+        try:
+            messages = await cached_response("bible", build, [list(r) for r in ranges], use_strongs)
+        except workers.WorkerPoolBusy:
+            await ctx.send(BUSY_MESSAGE)
             return
+        except asyncio.TimeoutError:
+            await ctx.send(TIMEOUT_MESSAGE)
+            return
+        await output.send_messages(ctx, messages)
 
-        if '-' in chapter_verse:
-            chapter_part, verse_range = chapter_verse.split(':', 1)
-            start_verse, end_verse = verse_range.split('-', 1)
-        else:
-            chapter_part, start_verse = chapter_verse.split(':', 1)
-            end_verse = start_verse
-
-        chapter = int(chapter_part)
-        start_verse = int(start_verse)
-        end_verse = int(end_verse)
-
-
-        # Map the book name to its corresponding integer ID
-        book_to_int = {
-            "genesis": 1, "exodus": 2, "leviticus": 3, "numbers": 4, "deuteronomy": 5,
-            "joshua": 6, "judges": 7, "ruth": 8, "1 samuel": 9, "2 samuel": 10,
-            "1 kings": 11, "2 kings": 12, "1 chronicles": 13, "2 chronicles": 14,
-            "ezra": 15, "nehemiah": 16, "esther": 17, "job": 18, "psalms": 19,
-            "proverbs": 20, "ecclesiastes": 21, "song of solomon": 22, "isaiah": 23,
-            "jeremiah": 24, "lamentations": 25, "ezekiel": 26, "daniel": 27,
-            "hosea": 28, "joel": 29, "amos": 30, "obadiah": 31, "jonah": 32,
-            "micah": 33, "nahum": 34, "habakkuk": 35, "zephaniah": 36, "haggai": 37,
-            "zechariah": 38, "malachi": 39, "matthew": 40, "mark": 41, "luke": 42,
-            "john": 43, "acts": 44, "romans": 45, "1 corinthians": 46, "2 corinthians": 47,
-            "galatians": 48, "ephesians": 49, "philippians": 50, "colossians": 51,
-            "1 thessalonians": 52, "2 thessalonians": 53, "1 timothy": 54,
-            "2 timothy": 55, "titus": 56, "philemon": 57, "hebrews": 58, "james": 59,
-            "1 peter": 60, "2 peter": 61, "1 john": 62, "2 john": 63, "3 john": 64,
-            "jude": 65, "revelation": 66
-        }
-
-        if book not in book_to_int:
-            await ctx.send("Invalid book name. Please use the full book name.")
+    except Exception as e:
+        registry.inc("bot_command_errors_total", command="bible")
+        await ctx.send("An error occurred while fetching the verse.")
+        log.exception("Error: %s", e)
+
+
+@command(name="concordance")
+async def concordance_search(ctx, *, query: str):
+    try:
+        try:
+            parsed = concordance.parse_query(query)
+        except concordance.ConcordanceQueryError as e:
+            await ctx.send(str(e))
+            return
+        if not verse_concordance.available:
+            await ctx.send("The concordance isn't available right now.")
             return
 
-        book_id = book_to_int[book]
-        conn = sqlite3.connect('kjv.sqlite')
-        cursor = conn.cursor()
+        async def build():
+            result = await verse_concordance.search(
+                parsed, CONCORDANCE_PAGE_SIZE, (parsed.page - 1) * CONCORDANCE_PAGE_SIZE
+            )
+            pages = (result.total + CONCORDANCE_PAGE_SIZE - 1) // CONCORDANCE_PAGE_SIZE
+            if result.total == 0:
+                message = f"No verses found for {parsed.label}."
+                if not verse_concordance.ready:
+                    message += " The concordance is still being indexed, please try again shortly."
+                return [message]
+            if not result.hits:
+                return [f"There are only {pages} pages of verses for {parsed.label}."]
+
+            header = (
+                f"**Concordance for {parsed.label}**: {result.total} verses in {len(result.counts)} "
+                f"book{'s' if len(result.counts) != 1 else ''}, page {parsed.page}/{pages}"
+            )
+            if len(result.counts) > 1:
+                most = sorted(result.counts.items(), key=lambda item: (-item[1], item[0]))[:5]
+                header += "\nMost in: " + ", ".join(f"{references.book_name(book)} ({count})" for book, count in most)
+            if not verse_concordance.ready:
+                header += (f"\n*Still indexing, {verse_concordance.indexed} of "
+                           f"{verse_concordance.total} verses searched so far.*")
+            blocks = (
+                f"{references.book_name(book)} {chapter}:{verse} - {text}" for book, chapter, verse, text in result.hits
+            )
+            return output.build_messages(blocks, header)
 
-        verses = []
-        for verse_number in range(start_verse, end_verse + 1):
-            cursor.execute(
-                '''SELECT text FROM verses WHERE book = ? AND chapter = ? AND verse = ?''',
-                (book_id, chapter, verse_number)
+        try:
+            # Results from a half-built index would go stale, only cache complete ones
+            messages = await cached_response(
+                "concordance", build, parsed.match, sorted(parsed.books) if parsed.books else None, parsed.page,
+                cache=verse_concordance.ready
             )
-            result = cursor.fetchone()
-            if result:
-                verse_text = result[0]
+        except concordance.ConcordanceQueryError as e:
+            await ctx.send(str(e))
+            return
+        await output.send_messages(ctx, messages)
 
-                if use_strongs:
-                    verse_text = annotate_with_strongs(verse_text)
+    except Exception as e:
+        registry.inc("bot_command_errors_total", command="concordance")
+        await ctx.send("An error occurred while searching the concordance.")
+        log.exception("Error: %s", e)
 
-                verses.append(f"{book} {chapter}:{verse_number} - {verse_text}")
-            else:
-                verses.append(f"{book} {chapter}:{verse_number} - Verse not found!")
+        
+# Event: Bot is ready
+@event
+async def on_ready():
+    log.info("We have logged in as %s", bot.user)
+    log.info("Bot is connected to %d guilds", len(bot.guilds))
+    log.info("Running shards %s of %d", sorted(bot.shards), bot.shard_count or 1)
+    if "ready" not in startup_phases:
+        startup_phases["ready"] = time.perf_counter() - STARTUP_BEGAN
+        log.info("Ready %.2fs after starting", startup_phases["ready"])
 
-        conn.close()
-        await ctx.send("\n".join(verses))
+    # Index (or finish indexing) the concordance without holding up the bot
+    verse_concordance.start()
 
-    except Exception as e:
-        await ctx.send("An error occurred while fetching the verse.")
-        print(f"Error: {e}")
+    # Pick up prefix and rating changes made by other shard processes
+    state_changes.start()
 
-def annotate_with_strongs(verse_text):
-    """
-    Annotate the given verse text with Strong's numbers and make them clickable links.
-    """
-    words = verse_text.split()  # Split text into words
-    annotated_words = []
-
-    for word in words:
-        # Remove punctuation and lowercase for matching
-        clean_word = word.strip(",.?!;:\"'[]()").lower()
-
-        # Attempt to find the Strong's number
-        strongs_num = find_strongs(clean_word)
-        if strongs_num:
-            # Append the word with its Strong's number as a clickable link
-            link = f"[{strongs_num}](https://www.blueletterbible.org/lexicon/{strongs_num}/kjv/\u200b)"
-            annotated_words.append(f"{word} ({link})")
-        else:
-            # No match; just append the original word
-            annotated_words.append(word)
-    
-    # Join the annotated words back into a single string
-    return " ".join(annotated_words)
+    # Reload open polls, their close timers and start checkpointing votes
+    poll_tracker.start()
 
+    # on_ready fires again on reconnects, only start the metrics endpoint once
+    global metrics_runner
+    if METRICS_PORT and metrics_runner is None:
+        metrics_runner = await start_http_server(METRICS_HOST, int(METRICS_PORT))
+        log.info("Serving metrics on http://%s:%s/metrics", METRICS_HOST, METRICS_PORT)
 
-    return " ".join(annotated_words)
+metrics_runner = None
 
-def find_strongs(word):
-    """
-    Find the Strong's number for a given word from the Greek or Hebrew dictionaries.
-    Uses lemmatization as a fallback if no direct match is found.
-    """
-    
-    # Normalize the word to lowercase
-    word = word.lower()
-    
-    # Check in Greek dictionary
-    for key, value in strongs_greek.items():
-        if value["lemma"].lower() == word or value.get("kjv_def", "").lower() == word:
-            # Return key as-is if it already starts with 'G'
-            return key if key.startswith("G") else f"G{key}"
-
-    # Check in Hebrew dictionary
-    for key, value in strongs_hebrew.items():
-        if value["lemma"].lower() == word or value.get("kjv_def", "").lower() == word:
-            # Return key as-is if it already starts with 'H'
-            return key if key.startswith("H") else f"H{key}"
-            
-    # If no match, attempt lemmatization
-    lemma = lemmatizer.lemmatize(word)
-    # Retry matching with lemmatized word
-    for key, value in strongs_greek.items():
-        if value["lemma"].lower() == lemma or value.get("kjv_def", "").lower() == lemma:
-            return key if key.startswith("G") else f"G{key}"
-    for key, value in strongs_hebrew.items():
-        if value["lemma"].lower() == lemma or value.get("kjv_def", "").lower() == lemma:
-            return key if key.startswith("H") else f"H{key}"
-
-    # No match found
-    return None
+@event
+async def on_shard_ready(shard_id):
+    log.info("Shard %d is ready", shard_id)
 
-        
-# Event: Bot is ready
-@bot.event
-async def on_ready():
-    print(f'We have logged in as {bot.user}')
-    print(f'Bot is connected to the following guilds: {bot.guilds}')
     
-@bot.event
+@event
 async def on_message(message):
-    print(f"Message received: {message.content}")  # This will print all messages the bot sees
-    await bot.process_commands(message)  # This is necessary to process commands
+    log.debug("Message received: %s", message.content)  # Sampled, see LOG_SAMPLE_RATE
+    if bot.user is not None and message.author.id == bot.user.id:
+        recent_messages.add(message.channel.id, message.id)
+        return
+    if message.author.bot:
+        return
+
+    # Same as bot.process_commands, keeping the context to see if this is a command
+    ctx = await bot.get_context(message)
+    if ctx.valid:
+        # Matched against this guild's prefix, so !clear knows exactly which messages were commands
+        recent_messages.add(message.channel.id, message.id)
+    await bot.invoke(ctx)  # This is necessary to process commands
+
+@event
+async def on_raw_message_delete(payload):
+    recent_messages.discard(payload.channel_id, [payload.message_id])
+
+@event
+async def on_raw_bulk_message_delete(payload):
+    recent_messages.discard(payload.channel_id, payload.message_ids)
     
-@bot.event
+# Time every command; these are the bot's before/after invoke hooks, see create_bot().
+# The after hook runs even when the command raises
+async def start_command_timer(ctx):
+    # Charge the command to its user's and guild's token buckets, raises scheduler.RateLimited.
+    # Not a bot.check: checks also run for every command !help lists
+    ctx.cost = command_cost(ctx)
+    request_scheduler.admit(ctx.author.id, ctx.guild.id if ctx.guild else None, ctx.cost)
+    ctx.started_at = time.perf_counter()
+    # Heavy commands wait for a slot in the heavy lane, cheap ones go straight through
+    ctx.holds_heavy_slot = await request_scheduler.acquire(ctx.cost)
+
+async def record_command_time(ctx):
+    if getattr(ctx, "holds_heavy_slot", False):
+        request_scheduler.release()
+    started_at = getattr(ctx, "started_at", None)
+    if started_at is not None:
+        registry.observe("bot_command_seconds", time.perf_counter() - started_at, command=ctx.command.qualified_name)
+    registry.inc("bot_commands_total", command=ctx.command.qualified_name)
+
+@event
 async def on_command_error(ctx, error):
+    registry.inc("bot_command_errors_total", command=ctx.command.qualified_name if ctx.command else "unknown")
     if isinstance(error, commands.CommandNotFound):
         await ctx.send("Sorry, I didn't recognize that command.")
     elif isinstance(error, commands.MissingRequiredArgument):
         await ctx.send("You're missing some required arguments!")
+    elif isinstance(error, commands.MissingPermissions):
+        missing = ", ".join(permission.replace("_", " ") for permission in error.missing_permissions)
+        await ctx.send(f"You need the {missing} permission to do that.")
+    elif isinstance(error, scheduler.RateLimited):
+        if request_scheduler.should_warn(error):
+            await ctx.send(f"You're sending commands too quickly, please wait {error.retry_after:.1f}s and try again.")
+    elif isinstance(error, scheduler.Overloaded):
+        await ctx.send(BUSY_MESSAGE)
         
-@bot.command()
-async def setprefix(ctx, prefix: str):
-    bot.command_prefix = prefix
+@command()
+@commands.guild_only()
+@commands.has_permissions(manage_guild=True)
+async def setprefix(ctx, prefix: str = DEFAULT_PREFIX):
+    # Only this server's prefix changes; every shard picks it up through threads.db.
+    # Without an argument the prefix goes back to the default
+    if len(prefix) > MAX_PREFIX_LENGTH or not prefix.isprintable() or any(char.isspace() for char in prefix):
+        await ctx.send(f"A prefix must be 1 to {MAX_PREFIX_LENGTH} visible characters without spaces.")
+        return
+    await guild_prefixes.set(ctx.guild.id, prefix)
     await ctx.send(f"Prefix changed to: {prefix}")
 
-@bot.command()
+@command()
 async def ping(ctx):
     await ctx.send("Pong! 🏓")
 
 # Command: Respond to "!hello"
-@bot.command()
+@command()
 async def hello(ctx):
-    print(f"Received command: {ctx.command}")  # This is to confirm command is received
+    log.debug("Received command: %s", ctx.command)  # This is to confirm command is received
     try:
         await ctx.send("Hello! 👋")
         
         
-        print("Sent response: Hello! 👋")  # Log if the response is successfully sent
+        log.debug("Sent response: Hello! 👋")  # Log if the response is successfully sent
     except Exception as e:
-        print(f"Error sending message: {e}")  # Log any error that occurs when sending
+        log.warning("Error sending message: %s", e)  # Log any error that occurs when sending
         
-@bot.command()
+@command()
 async def botinfo(ctx):
     help_message = """
     Here are the commands you can use:
     - !hello: Greets the bot
     - !userinfo: Shows your user information
     - !serverinfo: Shows information about the server
-    - !setprefix: changes the special character to call commands
+    - !setprefix: (needs manage server) changes the special character to call commands in this server, no argument resets it to ! and @mentioning the bot always works
     - !ping: pong
-    - !poll: makes a quick poll ex: !poll title "topic" "topic" "topic"
+    - !poll: makes a quick poll ex: !poll title "topic" "topic" "topic", add -close 30m to close it and post the results automatically
+    - !pollresults: shows the vote counts of the latest poll in the channel, or of a poll by message id
     - !listthreads: display all threads in current channel and there info
     - !ratethread: change the rating on a thread for example !ratethread #lucifer 1, 2, 3, 4, 5
     - !bible: type "Book chapter:verse-verse" you can also annotate with strongs. ex: !bible -strongs Proverbs 25:2-3
+      abbreviations, whole chapters and several references work too. ex: !bible jn 3:16-4:2; rom 5:8 or !bible ps 23
+    - !concordance: find every verse with a word or "a phrase". ex: !concordance "only begotten" -nt
+      lov* matches word prefixes, faith ~5 works finds words near each other, -in john, romans or -ot limits the books, -page 2 shows more
+    - !clear: (needs manage messages) deletes the bot's messages and commands, the last 100 by default ex: !clear 20
+    - !clearcache: (admin) drop cached responses, optionally for one command ex: !clearcache bible
+    - !stats: (admin) command latency percentiles, errors and cache hit rates
     - !strongs: type G or H and then the number you are trying to lookup. ex: G2045 you can also type !strongs search "word" and optionally -g or -h to specify only greek or hebrew words. ex !strongs search love -g
+      !strongs verses G26 lists every verse containing that number, optionally a page ex: !strongs verses G26 2
+      !strongs tree G26 shows the words it derives from and the words derived from it, optionally more hops ex: !strongs tree H1254 3
     """
     await ctx.send(help_message)
 
-@bot.command()
+@command()
+@commands.has_permissions(administrator=True)
+async def stats(ctx):
+    """Show per-command latency percentiles, error counts and cache hit rates."""
+    lines = ["**Command latency (ms)**", "```", f"{'command':<14}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'errors':>8}"]
+    for labels, histogram in sorted(registry.histograms("bot_command_seconds").items()):
+        command = dict(labels)["command"]
+        errors = registry.counter_value("bot_command_errors_total", command=command)
+        lines.append(
+            f"{command:<14}{histogram.count:>7}"
+            f"{histogram.percentile(0.50) * 1000:>9.1f}{histogram.percentile(0.95) * 1000:>9.1f}"
+            f"{histogram.percentile(0.99) * 1000:>9.1f}{errors:>8}"
+        )
+    lines.append("```")
+
+    cache = database.chapter_cache.stats()
+    lookups = cache["hits"] + cache["misses"]
+    hit_rate = cache["hits"] / lookups * 100 if lookups else 0.0
+    lines.append(f"**Chapter cache**: {cache['size']} chapters, {hit_rate:.1f}% hit rate ({cache['hits']}/{lookups})")
+    lines.append(f"**DB queries**: {registry.counter_value('bot_db_queries_total', database=os.path.basename(database.kjv_db.path))} kjv, "
+                 f"{registry.counter_value('bot_db_queries_total', database=os.path.basename(threads_db.path))} threads")
+    cached = responses.stats()
+    lines.append(f"**Response cache**: {cached['entries']} entries, {cached['bytes'] / 1024:.0f} KiB, "
+                 f"{cached['hits'] + cached['disk_hits']} hits / {cached['misses']} misses")
+    lines.append(f"**Worker jobs pending**: {lexicon_workers.pending}")
+    lines.append("**Startup**: " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in startup_phases.items()))
+    await ctx.send("\n".join(lines))
+
+@command()
+@commands.has_permissions(administrator=True)
+async def clearcache(ctx, command: str = None):
+    """Drop cached responses, for every command or just one (strongs, strongs_tree, strongs_verses, search_strongs, bible, concordance)."""
+    await responses.invalidate(command)
+    # Other shard processes drop their in-memory copies when their change feed sees this
+    await state_changes.publish("response_cache", command or response_cache.ALL_COMMANDS)
+    await ctx.send(f"Cleared cached responses for {command or 'all commands'}.")
+
+@command()
 async def userinfo(ctx):
     user = ctx.author
     user_info = f"Username: {user.name}\nID: {user.id}\nJoined at: {user.joined_at}"
     await ctx.send(user_info)
     
 
-@bot.command()
+@command()
 async def serverinfo(ctx):
     server = ctx.guild
     server_info = f"Server name: {server.name}\nMember count: {server.member_count}"
     await ctx.send(server_info)
     
-@bot.command()
+@command()
 async def poll(ctx, question, *options):
+    # An optional "-close 30m" at the end closes the poll and posts the results after that long
+    duration = None
+    if len(options) >= 2 and options[-2].lower() == "-close":
+        duration = polls.parse_duration(options[-1])
+        if duration is None or duration > polls.MAX_DURATION:
+            await ctx.send("Use a duration like `-close 30m`, `-close 2h` or `-close 1d` (at most 7 days).")
+            return
+        options = options[:-2]
+
     if len(options) < 2:
         await ctx.send("You need at least two options for a poll!")
         return
+    if len(options) > polls.MAX_OPTIONS:
+        await ctx.send(f"A poll can have at most {polls.MAX_OPTIONS} options.")
+        return
+
+    description = "\n".join(f"{emoji} {option}" for emoji, option in zip(polls.OPTION_EMOJIS, options))
+    if duration:
+        description += f"\n\nCloses in {polls.format_duration(duration)}."
+    poll_message = await ctx.send(embed=discord.Embed(title=question, description=description))
+    await poll_tracker.create(poll_message.id, ctx.channel.id, ctx.guild.id if ctx.guild else None,
+                              question, options, duration)
+
+    # Only the reactions this poll needs, added in order in the background;
+    # discord.py paces them to the reaction rate limit
+    task = asyncio.create_task(add_poll_reactions(poll_message, len(options)))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def add_poll_reactions(poll_message, count):
+    for emoji in polls.OPTION_EMOJIS[:count]:
+        try:
+            await poll_message.add_reaction(emoji)
+        except discord.HTTPException as e:
+            log.warning("Adding poll reaction %s failed: %s", emoji, e)
+            return
+
+
+@command()
+async def pollresults(ctx, message_id: int = None):
+    """Results of a poll from the live tally, the latest one in this channel by default."""
+    if message_id is None:
+        result = await poll_tracker.latest_in_channel(ctx.channel.id)
+    else:
+        result = await poll_tracker.get(message_id)
+    if result is None:
+        await ctx.send("I couldn't find that poll.")
+        return
+    await ctx.send(result.summary())
+
+
+async def post_poll_results(result):
+    channel = bot.get_channel(result.channel_id)
+    if channel is not None:
+        await channel.send(result.summary())
+
+
+@event
+async def on_raw_reaction_add(payload):
+    if bot.user is not None and payload.user_id != bot.user.id:
+        poll_tracker.vote(payload.message_id, payload.user_id, str(payload.emoji), True)
+
+
+@event
+async def on_raw_reaction_remove(payload):
+    if bot.user is not None and payload.user_id != bot.user.id:
+        poll_tracker.vote(payload.message_id, payload.user_id, str(payload.emoji), False)
+
 
-    embed = discord.Embed(title=question, description="\n".join(f"{i+1}. {option}" for i, option in enumerate(options)))
-    poll_message = await ctx.send(embed=embed)
-    for emoji in ['1️⃣', '2️⃣', '3️⃣', '4️⃣', '5️⃣']:
-        await poll_message.add_reaction(emoji)
-        
         
 # Set up the SQLite database (You can replace 'threads.db' with a different name or path)
 def setup_db():
-    conn = sqlite3.connect('threads.db')
-    cursor = conn.cursor()
-    
-    # Create a table for thread ratings
-    cursor.execute('''CREATE TABLE IF NOT EXISTS thread_info (
-                        thread_id INTEGER PRIMARY KEY,
-                        thread_name TEXT,
-                        owner_id INTEGER,
-                        rating INTEGER
-                    )''')
-    
-    conn.commit()
-    conn.close()
+    def create_tables(conn):
+        # Create a table for thread ratings
+        with conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS thread_info (
+                                thread_id INTEGER PRIMARY KEY,
+                                thread_name TEXT,
+                                owner_id INTEGER,
+                                rating INTEGER
+                            )''')
+
+    threads_db.run_sync(create_tables)
+    threads_db.run_sync(database.setup_shared_state)
+    threads_db.run_sync(polls.setup)
+    database.setup_kjv_db()
 
-setup_db()
 
 RATING_MESSAGES = {
     1: "Probably Opinion",
@@ -423,7 +911,7 @@ RATING_MESSAGES = {
     5: "Irrefutable Truth"
 }
 
-@bot.command()
+@command()
 async def ratethread(ctx, thread: discord.Thread, rating: int):
      # Ensure the rating is between 1 and 5
     if rating < 1 or rating > 5:
@@ -433,22 +921,13 @@ async def ratethread(ctx, thread: discord.Thread, rating: int):
     # Get the corresponding message for the rating
     rating_message = RATING_MESSAGES[rating]
 
-    # Connect to the database
-    conn = sqlite3.connect('threads.db')
-    cursor = conn.cursor()
-
-    # Insert or update the rating for the thread
-    cursor.execute('''INSERT OR REPLACE INTO thread_info (thread_id, thread_name, owner_id, rating)
-                      VALUES (?, ?, ?, ?)''', 
-                   (thread.id, thread.name, thread.owner.id, rating))
-
-    conn.commit()
-    conn.close()
+    # Insert or update the rating for the thread (also updates the in-memory rating cache)
+    await database.thread_ratings.set(thread.id, thread.name, thread.owner.id, rating)
 
     await ctx.send(f"Thread **{thread.name}** has been rated {rating}/5: **{rating_message}**!")
     
         
-@bot.command()
+@command()
 async def listthreads(ctx, channel: discord.TextChannel = None):
     # If no channel is provided, use the current channel
     if not channel:
@@ -462,51 +941,118 @@ async def listthreads(ctx, channel: discord.TextChannel = None):
         await ctx.send(f"No active threads in the channel {channel.mention}.")
         return
     
-    # Prepare a message to display thread details
-    thread_info = f"Active Threads in {channel.mention}:\n"
-    
-    for thread in threads:
-        # Fetch rating from the database
-        conn = sqlite3.connect('threads.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT rating FROM thread_info WHERE thread_id = ?", (thread.id,))
-        rating = cursor.fetchone()
-        conn.close()
-        
-        # If no rating is found, set it to 'Unrated' with a rating of 0
-        if rating:
-            rating_value = rating[0]
+    # Fetch every thread's rating in one batched lookup
+    ratings = await database.thread_ratings.get_many([thread.id for thread in threads])
+
+    def thread_blocks():
+        for thread in threads:
+            # If no rating is found, set it to 'Unrated' with a rating of 0
+            rating_value = ratings.get(thread.id) or 0
             rating_message = RATING_MESSAGES.get(rating_value, "Unrated")
-        else:
-            rating_value = 0
-            rating_message = "Unrated"
-        
-        # Get the thread information
-        thread_name = thread.name
-        thread_owner = thread.owner
-        thread_creation = thread.created_at.strftime("%Y-%m-%d %H:%M:%S")
-        thread_id = thread.id
-        thread_info += f"\n**{thread_name}** (ID: {thread_id})\nOwner: {thread_owner}\nCreated at: {thread_creation}\nRating: {rating_value}/5 - {rating_message}\n"
-
-    await ctx.send(thread_info)
+
+            # Get the thread information
+            thread_creation = thread.created_at.strftime("%Y-%m-%d %H:%M:%S")
+            yield (
+                f"**{thread.name}** (ID: {thread.id})\nOwner: {thread.owner}\n"
+                f"Created at: {thread_creation}\nRating: {rating_value}/5 - {rating_message}\n"
+            )
+
+    # Stream the list out in as few messages as possible
+    await output.send_blocks(ctx, thread_blocks(), header=f"Active Threads in {channel.mention}:\n")
     
     # Clear command messages and bot messages
-@bot.command()
+@command()
 @commands.has_permissions(manage_messages=True)
 async def clear(ctx, limit: int = 100):
-    """Clear bot messages and command messages from the last `limit` messages."""
-    def is_target_message(message):
-        # Check if the message is from the bot or a command message (starts with the command prefix)
-        return message.author == bot.user or message.content.startswith("!")
-
+    """Clear the last `limit` bot messages and command messages."""
+    if not 1 <= limit <= MAX_CLEAR:
+        await ctx.send(f"Please give a number of messages from 1 to {MAX_CLEAR}.", delete_after=5)
+        return
+    message_ids = recent_messages.recent(ctx.channel.id, limit)
     try:
-        deleted = await ctx.channel.purge(limit=limit, check=is_target_message)
-        await ctx.send(f"Cleared {len(deleted)} bot and command messages.", delete_after=5)
+        if len(message_ids) <= 1:
+            # Nothing recorded here since the bot started besides this command:
+            # scan the history instead, matching this guild's prefix
+            prefixes = tuple(await bot.get_prefix(ctx.message))
+
+            def is_target_message(message):
+                return message.author == bot.user or message.content.startswith(prefixes)
+
+            deleted = len(await ctx.channel.purge(limit=limit, check=is_target_message))
+        else:
+            deleted = await delete_messages(ctx.channel, message_ids)
+        await ctx.send(f"Cleared {deleted} bot and command messages.", delete_after=5)
     except discord.Forbidden:
         await ctx.send("I don't have permission to manage messages in this channel.", delete_after=5)
     except discord.HTTPException as e:
         await ctx.send(f"An error occurred: {e}", delete_after=5)
 
 
+async def delete_messages(channel, message_ids):
+    """
+    Delete messages by id without reading history: bulk deletes of up to 100
+    for messages under 14 days old, one call per message for older ones.
+    Returns how many were deleted.
+    """
+    bulk, single = message_index.split_by_age(message_ids)
+    deleted = 0
+    for chunk in message_index.chunks(bulk):
+        try:
+            await channel.delete_messages([discord.Object(id=message_id) for message_id in chunk])
+            registry.inc("bot_clear_api_calls_total", method="bulk")
+            deleted += len(chunk)
+        except discord.NotFound:
+            # Something in the chunk was already deleted, go through it one by one
+            single.extend(chunk)
+
+    for message_id in single:
+        try:
+            await channel.get_partial_message(message_id).delete()
+            registry.inc("bot_clear_api_calls_total", method="single")
+            deleted += 1
+        except discord.NotFound:
+            pass
+
+    recent_messages.discard(channel.id, message_ids)
+    return deleted
+
+
+def create_bot():
+    new_bot = commands.AutoShardedBot(command_prefix=get_prefix, intents=intents,
+                                      shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+    for cmd in _commands:
+        new_bot.add_command(cmd)
+    for callback in _events:
+        new_bot.event(callback)
+    new_bot.before_invoke(start_command_timer)
+    new_bot.after_invoke(record_command_time)
+    new_bot.setup_hook = setup_hook
+    registry.gauge("bot_shard_latency_seconds", lambda: [
+        ({"shard": shard_id}, latency) for shard_id, latency in new_bot.latencies
+    ])
+    return new_bot
+
+
+def setup():
+    """
+    Everything with side effects: open the response cache (which purges its
+    expired entries), create the database tables and build the bot. Worker
+    processes re-import this module under spawn, so none of it may run at import.
+    """
+    global bot, responses
+    # RESPONSE_CACHE_PATH="" keeps the response cache memory-only
+    responses = response_cache.create(
+        max_bytes=int(float(os.environ.get("RESPONSE_CACHE_MB", "8")) * 1024 * 1024),
+        ttl=float(os.environ.get("RESPONSE_CACHE_TTL", "3600")),
+        disk_path=os.environ.get("RESPONSE_CACHE_PATH", response_cache.DISK_PATH) or None
+    )
+    state_changes.subscribe("response_cache", responses.forget)
+    setup_db()
+    bot = create_bot()
+    startup_phases["import"] = time.perf_counter() - STARTUP_BEGAN
+
+
 # Run the bot
-bot.run("MTMxODcwOTczNTA1MDE4MjcxNw.GW-vQS.X_D9GUt22HmOgVtcsn_YOYXyzy7tsVqbW0fsWg")
+if __name__ == "__main__":
+    setup()
+    bot.run("MTMxODcwOTczNTA1MDE4MjcxNw.GW-vQS.X_D9GUt22HmOgVtcsn_YOYXyzy7tsVqbW0fsWg")
@@ -0,0 +1,46 @@
+"""
+Compile the Strong's JSON dictionaries into the binary format the bot loads.
+
+    python build_lexicon.py            compile both dictionaries
+    python build_lexicon.py --measure  compile, then compare cold start and RSS
+                                       of loading JSON vs the compiled files
+"""
+import subprocess
+import sys
+
+import lexicon
+import lexicon_store
+
+# Each measurement runs in a fresh interpreter so nothing is already cached in-process
+_MEASURE_SCRIPT = """
+import resource, sys, time
+start = time.perf_counter()
+import lexicon
+greek, hebrew = getattr(lexicon, sys.argv[1])()
+greek.get("G26"); hebrew.get("H157")
+elapsed = time.perf_counter() - start
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def measure(loader):
+    output = subprocess.check_output([sys.executable, "-c", _MEASURE_SCRIPT, loader], text=True)
+    elapsed, max_rss = output.split()
+    # ru_maxrss is in kilobytes on Linux
+    return float(elapsed) * 1000, int(max_rss) / 1024
+
+
+def main():
+    for json_path, compiled_path in ((lexicon.GREEK_PATH, lexicon.GREEK_COMPILED_PATH),
+                                     (lexicon.HEBREW_PATH, lexicon.HEBREW_COMPILED_PATH)):
+        count = lexicon_store.compile_dictionary(json_path, compiled_path)
+        print(f"Compiled {count} entries from {json_path} into {compiled_path}")
+
+    if "--measure" in sys.argv:
+        for label, loader in (("JSON", "load_json_dictionaries"), ("compiled", "load_dictionaries")):
+            elapsed, max_rss = measure(loader)
+            print(f"{label:>8}: {elapsed:7.1f} ms to load, {max_rss:6.1f} MB peak RSS")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Precompute Strong's tags for every verse in kjv.sqlite into the verse_strongs table.
+
+    python build_verse_strongs.py --tagged kjv-strongs.tsv
+        import tags from a Strong's-tagged KJV, one verse per line as
+        "book<TAB>chapter<TAB>verse<TAB>text" with tags after the words they
+        belong to, e.g. "In the beginning{H7225} God{H430} created{H1254}{H853}"
+
+    python build_verse_strongs.py
+        no tagged source: run the bot's word-matching tagger over every verse
+        once, so at least -strongs no longer does it per request. These are
+        guesses, so the table is marked as such and !strongs verses says so
+
+    --kjv PATH  tag a different kjv.sqlite
+"""
+import argparse
+import re
+import sqlite3
+import time
+
+import database
+import lexicon
+
+# "{H7225}" or "{G0026}"; morphology codes like "{(H8804)}" are skipped
+_TAG_RE = re.compile(r"\{([GH]\d+[a-z]?)\}")
+_ANY_TAG_RE = re.compile(r"\{[^}]*\}")
+
+BATCH_SIZE = 10000
+
+
+def parse_tagged(text):
+    """
+    Split a tagged verse into [(position, Strong's number)], positions counting
+    the words left once the tags are removed.
+    """
+    tags = []
+    position = -1
+    for token in text.split():
+        numbers = _TAG_RE.findall(token)
+        if _ANY_TAG_RE.sub("", token):
+            position += 1
+        # A tag standing alone after a space belongs to the previous word
+        for number in numbers:
+            if position >= 0:
+                tags.append((position, lexicon.normalize_strongs_number(number)))
+    return tags
+
+
+def tagged_source(path):
+    """
+    Yield (book, chapter, verse, position, strongs) rows from a tagged TSV.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            parts = line.rstrip("\n").split("\t", 3)
+            if len(parts) != 4 or not parts[0].isdigit():
+                continue
+            book, chapter, verse = int(parts[0]), int(parts[1]), int(parts[2])
+            for position, number in parse_tagged(parts[3]):
+                yield book, chapter, verse, position, number
+
+
+def heuristic_source(conn):
+    """
+    Yield (book, chapter, verse, position, strongs) rows using the bot's word tagger.
+    """
+    import workers
+    workers._init_worker()
+    for book, chapter, verse, text in conn.execute("SELECT book, chapter, verse, text FROM verses").fetchall():
+        for position, numbers in workers.strongs_tags(text).items():
+            for number in numbers:
+                yield book, chapter, verse, position, number
+
+
+def build(conn, rows, source):
+    """
+    Replace verse_strongs with `rows` in a single transaction, returning the row count.
+    `source` is database.TAGS_FROM_TAGGED_KJV or database.TAGS_FROM_HEURISTIC.
+    """
+    count = 0
+    with conn:
+        database.create_verse_strongs(conn, source)
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == BATCH_SIZE:
+                conn.executemany("INSERT OR IGNORE INTO verse_strongs VALUES (?, ?, ?, ?, ?)", batch)
+                count += len(batch)
+                batch = []
+        conn.executemany("INSERT OR IGNORE INTO verse_strongs VALUES (?, ?, ?, ?, ?)", batch)
+        count += len(batch)
+        database.index_verse_strongs(conn)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute verse-level Strong's tags in kjv.sqlite.")
+    parser.add_argument("--tagged", metavar="PATH", help="Strong's-tagged KJV to import tags from")
+    parser.add_argument("--kjv", default=database.KJV_PATH, help=f"database to tag (default {database.KJV_PATH})")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    conn = sqlite3.connect(args.kjv)
+    try:
+        if args.tagged:
+            count = build(conn, tagged_source(args.tagged), database.TAGS_FROM_TAGGED_KJV)
+        else:
+            count = build(conn, heuristic_source(conn), database.TAGS_FROM_HEURISTIC)
+    finally:
+        conn.close()
+    source = args.tagged or "the word-matching tagger"
+    print(f"Stored {count} Strong's tags from {source} in {args.kjv} in {time.perf_counter() - start:.1f}s")
+    if not args.tagged:
+        print("These tags are guesses from matching English words to definitions; "
+              "!strongs verses will label its results accordingly. Use --tagged for real tags.")
+
+
+if __name__ == "__main__":
+    main()
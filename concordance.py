@@ -0,0 +1,281 @@
+"""
+Concordance over the KJV text: where does a word or phrase occur?
+
+The index is an SQLite FTS5 table inside kjv.sqlite (external content, so the
+verse text isn't stored twice). FTS5 keeps positional, delta-encoded varint
+posting lists, which gives phrase and NEAR queries for free.
+
+The index is filled incrementally in batches of verses, remembering how far
+it got, so a build started in the background at startup resumes where the
+last one stopped, and searches work (on partial results) while it runs.
+
+Query syntax for !concordance:
+
+    love                      a word
+    "only begotten"           a phrase
+    lov*                      a word prefix
+    faith ~5 works            words within 5 words of each other
+    -in john, romans          only these books
+    -ot / -nt                 only the Old or New Testament
+    -page 2                   later pages of hits
+"""
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import time
+from collections import namedtuple
+
+import references
+from metrics import registry
+
+log = logging.getLogger(__name__)
+
+# Verses added to the index per transaction
+BATCH_SIZE = 2000
+
+# Highest -page accepted: more pages than any search fills, and an offset far
+# inside SQLite's integer range
+MAX_PAGE = 10000
+
+OLD_TESTAMENT = range(1, 40)
+NEW_TESTAMENT = range(40, 67)
+
+_TOKEN_RE = re.compile(r'"[^"]*"?|\S+')
+_NEAR_RE = re.compile(r"~(\d+)$")
+
+
+class ConcordanceQueryError(ValueError):
+    """
+    Raised for a query that can't be turned into a search; the message is shown to the user.
+    """
+
+
+# match: FTS5 query, books: set of book numbers or None, label: the terms as shown back to the user
+ConcordanceQuery = namedtuple("ConcordanceQuery", "match books page label")
+
+# total: matching verses, counts: {book: verses}, hits: [(book, chapter, verse, highlighted text)]
+ConcordanceResult = namedtuple("ConcordanceResult", "total counts hits")
+
+
+def _term(token):
+    # Quote every term so user input can never be read as FTS5 syntax
+    prefix = token.endswith("*") and not token.startswith('"')
+    words = re.findall(r"\w+", token.lower())
+    if not words:
+        return None
+    return '"' + " ".join(words) + '"' + ("*" if prefix else "")
+
+
+def _books(text):
+    # Book numbers for a comma-separated list of names, or None if any name isn't a book
+    books = set()
+    for name in text.split(","):
+        if name.strip():
+            book = references.resolve_book(name)
+            if book is None:
+                return None
+            books.add(book)
+    return books or None
+
+
+def parse_query(text):
+    """
+    Turn !concordance arguments into a ConcordanceQuery.
+    """
+    tokens = _TOKEN_RE.findall(text.strip())
+    groups = []  # [terms, near distance or None]
+    books = None
+    page = 1
+    near = None
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        lowered = token.lower()
+        if lowered in ("-ot", "-nt"):
+            testament = set(OLD_TESTAMENT if lowered == "-ot" else NEW_TESTAMENT)
+            books = testament if books is None else books & testament
+        elif lowered in ("-page", "-p"):
+            i += 1
+            if i == len(tokens) or not tokens[i].isdigit() or int(tokens[i]) < 1:
+                raise ConcordanceQueryError("`-page` needs a page number, e.g. `-page 2`.")
+            page = min(int(tokens[i]), MAX_PAGE)
+        elif lowered == "-in":
+            end = i + 1
+            while end < len(tokens) and not tokens[end].startswith("-"):
+                end += 1
+            # The longest run of following words that names books, anything after it is search terms
+            for stop in range(end, i + 1, -1):
+                selected = _books(" ".join(tokens[i + 1:stop]))
+                if selected:
+                    break
+            else:
+                if i + 1 < end:
+                    raise ConcordanceQueryError(f"I don't recognise the book '{tokens[i + 1].strip(',')}'.")
+                raise ConcordanceQueryError("`-in` needs a book name, e.g. `-in john`.")
+            books = selected if books is None else books & selected
+            i = stop - 1
+        elif _NEAR_RE.match(token):
+            if not groups:
+                raise ConcordanceQueryError("`~N` goes between two words, e.g. `faith ~5 works`.")
+            near = int(_NEAR_RE.match(token).group(1))
+        else:
+            term = _term(token)
+            if term is not None:
+                if near is not None:
+                    groups[-1][0].append(term)
+                    groups[-1][1] = near
+                    near = None
+                else:
+                    groups.append([[term], None])
+        i += 1
+
+    if near is not None:
+        raise ConcordanceQueryError("`~N` goes between two words, e.g. `faith ~5 works`.")
+    if not groups:
+        raise ConcordanceQueryError("Please give a word or \"a phrase\" to look up, e.g. `!concordance \"only begotten\" -nt`.")
+    if books is not None and not books:
+        raise ConcordanceQueryError("Those book filters don't leave any books to search.")
+
+    parts = []
+    labels = []
+    for terms, distance in groups:
+        if distance is None:
+            parts.append(terms[0])
+            labels.append(terms[0])
+        else:
+            parts.append(f"NEAR({' '.join(terms)}, {distance})")
+            labels.append(f" ~{distance} ".join(terms))
+    return ConcordanceQuery(" AND ".join(parts), frozenset(books) if books else None, page, " ".join(labels))
+
+
+def _setup(conn):
+    # Returns (last indexed verse rowid, verses indexed so far, verses in total)
+    with conn:
+        # Indexes from older versions were keyed on an `id` column that not every kjv.sqlite has
+        row = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'verses_fts'").fetchone()
+        if row is not None and "content_rowid" in row[0]:
+            conn.execute("DROP TABLE verses_fts")
+            conn.execute("DROP TABLE IF EXISTS concordance_progress")
+        # Keyed on the verses table's implicit rowid
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS verses_fts USING fts5("
+            "text, content='verses', tokenize='unicode61 remove_diacritics 2')"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS concordance_progress (last_id INTEGER NOT NULL)")
+        row = conn.execute("SELECT last_id FROM concordance_progress").fetchone()
+        if row is None:
+            conn.execute("INSERT INTO concordance_progress (last_id) VALUES (0)")
+            row = (0,)
+    last_id = row[0]
+    indexed = conn.execute("SELECT COUNT(*) FROM verses WHERE rowid <= ?", (last_id,)).fetchone()[0]
+    total = conn.execute("SELECT COUNT(*) FROM verses").fetchone()[0]
+    return last_id, indexed, total
+
+
+def _index_batch(conn, last_id, batch_size):
+    # Index the next batch of verses and move the high-water mark in the same transaction
+    with conn:
+        rows = conn.execute(
+            "SELECT rowid, text FROM verses WHERE rowid > ? ORDER BY rowid LIMIT ?", (last_id, batch_size)
+        ).fetchall()
+        if rows:
+            conn.executemany("INSERT INTO verses_fts (rowid, text) VALUES (?, ?)", rows)
+            conn.execute("UPDATE concordance_progress SET last_id = ?", (rows[-1][0],))
+    return (rows[-1][0] if rows else last_id), len(rows)
+
+
+def _optimize(conn):
+    # Merge the per-batch segments into one b-tree for faster queries
+    with conn:
+        conn.execute("INSERT INTO verses_fts (verses_fts) VALUES ('optimize')")
+
+
+def _search(conn, match, books, limit, offset):
+    where = "verses_fts MATCH ?"
+    params = [match]
+    if books:
+        where += f" AND v.book IN ({','.join('?' * len(books))})"
+        params += sorted(books)
+    # CROSS JOIN keeps the FTS index as the outer loop; otherwise a book filter
+    # makes SQLite walk the book's verses and re-run the match for each one
+    source = f"FROM verses_fts CROSS JOIN verses v ON v.rowid = verses_fts.rowid WHERE {where}"
+    counts = dict(conn.execute(f"SELECT v.book, COUNT(*) {source} GROUP BY v.book", params).fetchall())
+    page = conn.execute(
+        f"SELECT v.rowid, v.book, v.chapter, v.verse {source} ORDER BY v.book, v.chapter, v.verse LIMIT ? OFFSET ?",
+        params + [limit, offset]
+    ).fetchall()
+
+    # Highlight only the verses on this page
+    highlighted = {}
+    if page:
+        highlighted = dict(conn.execute(
+            f"SELECT rowid, highlight(verses_fts, 0, '**', '**') FROM verses_fts "
+            f"WHERE verses_fts MATCH ? AND rowid IN ({','.join('?' * len(page))})",
+            [match] + [row[0] for row in page]
+        ).fetchall())
+    hits = [(book, chapter, verse, highlighted.get(verse_id, "")) for verse_id, book, chapter, verse in page]
+    return ConcordanceResult(sum(counts.values()), counts, hits)
+
+
+class Concordance:
+    def __init__(self, db, batch_size=BATCH_SIZE):
+        self.db = db
+        self.batch_size = batch_size
+        self.indexed = 0
+        self.total = 0
+        self.ready = False
+        self.failed = False
+        self._task = None
+
+    @property
+    def available(self):
+        # After a failed build every search would fail too, so don't offer any
+        return os.path.exists(self.db.path) and not self.failed
+
+    def start(self):
+        """
+        Build (or finish building) the index in the background. Safe to call more than once.
+        """
+        if self._task is None and self.available:
+            self._task = asyncio.create_task(self.build())
+        return self._task
+
+    async def build(self):
+        start = time.perf_counter()
+        try:
+            last_id, self.indexed, self.total = await self.db.run(_setup)
+            added = 0
+            while True:
+                last_id, count = await self.db.run(_index_batch, last_id, self.batch_size)
+                if not count:
+                    break
+                added += count
+                self.indexed += count
+            if added:
+                await self.db.run(_optimize)
+                log.info("Indexed %d verses for the concordance in %.1fs", added, time.perf_counter() - start)
+            self.ready = True
+        except sqlite3.Error as e:
+            self.failed = True
+            log.error("Building the concordance index failed: %s", e)
+
+    async def search(self, query, limit, offset=0):
+        try:
+            return await self.db.run(_search, query.match, query.books, limit, offset)
+        except sqlite3.OperationalError as e:
+            log.debug("Concordance query %r failed: %s", query.match, e)
+            raise ConcordanceQueryError("I couldn't run that search, please simplify the query.") from e
+
+    def stats(self):
+        return {"indexed": self.indexed, "total": self.total, "ready": int(self.ready)}
+
+
+def create(db):
+    """
+    Build the bot's concordance and export its build progress as metrics.
+    """
+    index = Concordance(db)
+    registry.gauge("bot_concordance", lambda: [({"stat": name}, value) for name, value in index.stats().items()])
+    return index
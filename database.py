@@ -0,0 +1,554 @@
+"""
+Shared SQLite access for the bot.
+
+Each database keeps long-lived connections (one per worker thread) and runs
+every query on its own thread pool, so disk I/O never blocks the event loop
+and a slow query on one database doesn't hold up the other.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import references
+from metrics import registry
+
+log = logging.getLogger(__name__)
+
+KJV_PATH = 'kjv.sqlite'
+THREADS_PATH = 'threads.db'
+
+# Number of prepared statements sqlite3 keeps cached per connection
+STATEMENT_CACHE_SIZE = 256
+
+# How many whole chapters of KJV text are kept in memory
+CHAPTER_CACHE_SIZE = 256
+
+# Stay under SQLite's default limit of 999 bound parameters per statement
+MAX_IN_PARAMS = 900
+
+# How often each process checks threads.db for changes made by other processes, in seconds
+CHANGE_POLL_INTERVAL = 2.0
+
+# Change log entries older than this are pruned, in seconds
+CHANGE_RETENTION = 24 * 60 * 60
+
+# Where the verse_strongs tags came from: a Strong's-tagged KJV, or the word-matching guesses
+TAGS_FROM_TAGGED_KJV = "tagged"
+TAGS_FROM_HEURISTIC = "heuristic"
+
+
+class Database:
+    def __init__(self, path, workers=1):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"sqlite-{path}")
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        # Each worker thread opens its connection once and reuses it
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, cached_statements=STATEMENT_CACHE_SIZE,
+                                   check_same_thread=False)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+            except sqlite3.DatabaseError as e:
+                log.warning("Could not enable WAL for %s: %s", self.path, e)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _call(self, fn, args):
+        name = os.path.basename(self.path)
+        registry.inc("bot_db_queries_total", database=name)
+        try:
+            with registry.timer("bot_db_query_seconds", database=name):
+                return fn(self._connection(), *args)
+        except Exception:
+            registry.inc("bot_db_errors_total", database=name)
+            raise
+
+    async def run(self, fn, *args):
+        """
+        Run fn(connection, *args) on this database's worker threads.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, fn, args)
+
+    def run_sync(self, fn, *args):
+        """
+        Blocking version of run() for use before the event loop starts.
+        """
+        return self._executor.submit(self._call, fn, args).result()
+
+    async def fetchone(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def execute(self, sql, params=()):
+        def _execute(conn):
+            with conn:
+                conn.execute(sql, params)
+        await self.run(_execute)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+
+class ChapterCache:
+    """
+    Bounded LRU of whole chapters keyed by (book, chapter), with hit/miss counters.
+    """
+
+    def __init__(self, maxsize=CHAPTER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._chapters = OrderedDict()
+
+    def get(self, key):
+        chapter = self._chapters.get(key)
+        if chapter is None:
+            self.misses += 1
+            return None
+        self._chapters.move_to_end(key)
+        self.hits += 1
+        return chapter
+
+    def put(self, key, chapter):
+        self._chapters[key] = chapter
+        self._chapters.move_to_end(key)
+        while len(self._chapters) > self.maxsize:
+            self._chapters.popitem(last=False)
+
+    def clear(self):
+        self._chapters.clear()
+
+    def stats(self):
+        return {"size": len(self._chapters), "hits": self.hits, "misses": self.misses}
+
+
+def _has_verse_index(conn):
+    # Look for any index whose leading columns are (book, chapter, verse)
+    for row in conn.execute("PRAGMA index_list(verses)").fetchall():
+        columns = [info[2] for info in conn.execute(f"PRAGMA index_info('{row[1]}')").fetchall()]
+        if columns[:3] == ["book", "chapter", "verse"]:
+            return True
+    return False
+
+
+def ensure_verse_index(conn):
+    """
+    Make sure verses has a composite (book, chapter, verse) index, creating one if needed.
+    """
+    if _has_verse_index(conn):
+        return False
+    with conn:
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_verses_book_chapter_verse ON verses (book, chapter, verse)")
+    return True
+
+
+def _range_selects(ranges, columns):
+    # One SELECT per range for a UNION ALL, each tagged with the range's index as `part`
+    selects = []
+    params = []
+    for index, (book, start_chapter, start_verse, end_chapter, end_verse) in enumerate(ranges):
+        selects.append(
+            f"SELECT ? AS part, {columns} FROM verses "
+            "WHERE book = ? AND chapter BETWEEN ? AND ? AND (chapter, verse) BETWEEN (?, ?) AND (?, ?)"
+        )
+        params += [index, book, start_chapter, end_chapter, start_chapter, start_verse, end_chapter, end_verse]
+    return selects, params
+
+
+def _load_ranges(conn, ranges):
+    # One UNION ALL query for every range, ordered by range then (chapter, verse)
+    selects, params = _range_selects(ranges, "chapter, verse, text")
+    sql = " UNION ALL ".join(selects) + " ORDER BY part, chapter, verse"
+    results = [[] for _ in ranges]
+    for part, chapter, verse, text in conn.execute(sql, params):
+        results[part].append((chapter, verse, text))
+    return results
+
+
+def _count_ranges(conn, ranges):
+    # Verses in all the ranges together, read from the (book, chapter, verse) index alone
+    selects, params = _range_selects(ranges, "verse")
+    return conn.execute(f"SELECT COUNT(*) FROM ({' UNION ALL '.join(selects)})", params).fetchone()[0]
+
+
+def create_verse_strongs(conn, source):
+    """
+    (Re)create the empty verse_strongs table: one row per Strong's tag, with
+    `position` the 0-based index of the tagged word in the verse text.
+    `source` (TAGS_FROM_TAGGED_KJV or TAGS_FROM_HEURISTIC) is recorded in
+    verse_strongs_source. Indexes are added by index_verse_strongs() once
+    the rows are in.
+    """
+    conn.execute("DROP TABLE IF EXISTS verse_strongs_source")
+    conn.execute("CREATE TABLE verse_strongs_source (source TEXT NOT NULL)")
+    conn.execute("INSERT INTO verse_strongs_source (source) VALUES (?)", (source,))
+    conn.execute("DROP TABLE IF EXISTS verse_strongs")
+    conn.execute('''CREATE TABLE verse_strongs (
+                        book INTEGER NOT NULL,
+                        chapter INTEGER NOT NULL,
+                        verse INTEGER NOT NULL,
+                        position INTEGER NOT NULL,
+                        strongs TEXT NOT NULL,
+                        PRIMARY KEY (book, chapter, verse, position, strongs)
+                    ) WITHOUT ROWID''')
+
+
+def index_verse_strongs(conn):
+    # The primary key covers range reads; this one serves "every verse containing G26"
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_verse_strongs_number ON verse_strongs (strongs, book, chapter, verse)")
+    conn.execute("ANALYZE verse_strongs")
+
+
+def has_verse_strongs(conn):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'verse_strongs'"
+    ).fetchone()
+    return row is not None and conn.execute("SELECT 1 FROM verse_strongs LIMIT 1").fetchone() is not None
+
+
+def get_verse_strongs_source(conn):
+    # Tables built before the source was recorded can't be trusted to come from a tagged KJV
+    try:
+        row = conn.execute("SELECT source FROM verse_strongs_source").fetchone()
+    except sqlite3.OperationalError:
+        return TAGS_FROM_HEURISTIC
+    return row[0] if row else TAGS_FROM_HEURISTIC
+
+
+def _load_tagged_ranges(conn, ranges):
+    # Same shape as _load_ranges, with each verse's tags joined in, one row per tag
+    selects = []
+    params = []
+    for index, (book, start_chapter, start_verse, end_chapter, end_verse) in enumerate(ranges):
+        selects.append(
+            "SELECT ? AS part, v.chapter, v.verse, v.text, s.position, s.strongs FROM verses v "
+            "LEFT JOIN verse_strongs s ON s.book = v.book AND s.chapter = v.chapter AND s.verse = v.verse "
+            "WHERE v.book = ? AND v.chapter BETWEEN ? AND ? AND (v.chapter, v.verse) BETWEEN (?, ?) AND (?, ?)"
+        )
+        params += [index, book, start_chapter, end_chapter, start_chapter, start_verse, end_chapter, end_verse]
+    sql = " UNION ALL ".join(selects) + " ORDER BY 1, 2, 3, 5"
+    results = [[] for _ in ranges]
+    for part, chapter, verse, text, position, strongs in conn.execute(sql, params):
+        verses = results[part]
+        if not verses or verses[-1][:2] != (chapter, verse):
+            verses.append((chapter, verse, text, {}))
+        if strongs is not None:
+            verses[-1][3].setdefault(position, []).append(strongs)
+    return results
+
+
+def _find_verses(conn, strongs, limit, offset):
+    total = conn.execute(
+        "SELECT COUNT(*) FROM (SELECT DISTINCT book, chapter, verse FROM verse_strongs WHERE strongs = ?)",
+        (strongs,)
+    ).fetchone()[0]
+    rows = conn.execute(
+        "SELECT v.book, v.chapter, v.verse, v.text FROM "
+        "(SELECT DISTINCT book, chapter, verse FROM verse_strongs WHERE strongs = ? "
+        " ORDER BY book, chapter, verse LIMIT ? OFFSET ?) s "
+        "JOIN verses v ON v.book = s.book AND v.chapter = s.chapter AND v.verse = s.verse "
+        "ORDER BY v.book, v.chapter, v.verse",
+        (strongs, limit, offset)
+    ).fetchall()
+    return total, rows
+
+
+# The KJV text is read-only so it can serve several lookups at once;
+# thread ratings get a single writer thread.
+kjv_db = Database(KJV_PATH, workers=4)
+threads_db = Database(THREADS_PATH, workers=1)
+chapter_cache = ChapterCache()
+
+# Set by setup_kjv_db() when build_verse_strongs.py has populated kjv.sqlite, and
+# whether those tags came from a Strong's-tagged KJV rather than word matching
+verse_strongs_available = False
+verse_strongs_tagged = False
+
+
+def _chapter_cache_metrics():
+    stats = chapter_cache.stats()
+    lookups = stats["hits"] + stats["misses"]
+    return [
+        ({"cache": "chapter", "stat": "hits"}, stats["hits"]),
+        ({"cache": "chapter", "stat": "misses"}, stats["misses"]),
+        ({"cache": "chapter", "stat": "size"}, stats["size"]),
+        ({"cache": "chapter", "stat": "hit_rate"}, stats["hits"] / lookups if lookups else 0.0),
+    ]
+
+
+registry.gauge("bot_cache", _chapter_cache_metrics)
+
+
+def setup_kjv_db():
+    """
+    Verify the verse index exists before the bot starts serving !bible, and
+    check whether precomputed Strong's tags are available.
+    """
+    global verse_strongs_available, verse_strongs_tagged
+    # Don't let sqlite create an empty kjv.sqlite if the file is missing
+    if not os.path.exists(kjv_db.path):
+        log.warning("%s not found, !bible will be unavailable", kjv_db.path)
+        return
+    if kjv_db.run_sync(ensure_verse_index):
+        log.info("Created composite (book, chapter, verse) index on verses")
+    verse_strongs_available = kjv_db.run_sync(has_verse_strongs)
+    if not verse_strongs_available:
+        log.info("No verse_strongs table in %s, run build_verse_strongs.py for tagged -strongs output", kjv_db.path)
+        return
+    verse_strongs_tagged = kjv_db.run_sync(get_verse_strongs_source) == TAGS_FROM_TAGGED_KJV
+    if not verse_strongs_tagged:
+        log.warning("verse_strongs in %s holds word-matching guesses, !strongs verses and !bible -strongs "
+                    "results will be marked as such; run build_verse_strongs.py --tagged for real tags", kjv_db.path)
+
+
+async def get_verse_ranges(ranges):
+    """
+    Fetch (chapter, verse, text) rows for each (book, start_chapter, start_verse,
+    end_chapter, end_verse) range.
+
+    Ranges inside a single chapter are served through the chapter cache. The
+    rest, and every chapter the cache is missing, are fetched together in a
+    single query.
+    """
+    results = [None] * len(ranges)
+    uncached = []
+    chapters = {}  # (book, chapter) -> {verse: text}, None until loaded
+    for index, (book, start_chapter, start_verse, end_chapter, end_verse) in enumerate(ranges):
+        if start_chapter != end_chapter:
+            uncached.append(index)
+        elif (book, start_chapter) not in chapters:
+            chapters[(book, start_chapter)] = chapter_cache.get((book, start_chapter))
+
+    missing = [key for key, verses in chapters.items() if verses is None]
+    if uncached or missing:
+        whole_chapters = [(book, chapter, 1, chapter, references.LAST_VERSE) for book, chapter in missing]
+        rows = await kjv_db.run(_load_ranges, [ranges[index] for index in uncached] + whole_chapters)
+        for index, verses in zip(uncached, rows):
+            results[index] = verses
+        for key, verses in zip(missing, rows[len(uncached):]):
+            chapters[key] = {verse: text for _, verse, text in verses}
+            if verses:
+                chapter_cache.put(key, chapters[key])
+
+    for index, (book, start_chapter, start_verse, end_chapter, end_verse) in enumerate(ranges):
+        if start_chapter == end_chapter:
+            verses = chapters[(book, start_chapter)]
+            results[index] = [
+                (start_chapter, verse, text) for verse, text in verses.items()
+                if start_verse <= verse <= end_verse
+            ]
+    return results
+
+
+async def count_verse_ranges(ranges):
+    """
+    Number of verses in all the ranges together, without fetching them.
+    """
+    return await kjv_db.run(_count_ranges, ranges)
+
+
+async def get_tagged_verse_ranges(ranges):
+    """
+    Like get_verse_ranges(), but every row is (chapter, verse, text, tags) with
+    tags {word position: [Strong's numbers]}, all ranges in one joined query.
+    """
+    return await kjv_db.run(_load_tagged_ranges, ranges)
+
+
+async def find_verses(strongs, limit, offset=0):
+    """
+    Return (total, [(book, chapter, verse, text)]) for the verses tagged with a
+    Strong's number, in canonical order, one page at a time.
+    """
+    return await kjv_db.run(_find_verses, strongs, limit, offset)
+
+
+class ThreadRatings:
+    """
+    In-memory cache of thread ratings in front of threads.db.
+
+    Lookups for many threads at once only query the ids that aren't cached
+    yet, in batched IN (...) queries. set() writes through, so the cache stays
+    in sync with !ratethread.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        # thread_id -> rating, or None for threads known to be unrated
+        self._ratings = {}
+
+    async def get_many(self, thread_ids):
+        missing = [thread_id for thread_id in thread_ids if thread_id not in self._ratings]
+        for start in range(0, len(missing), MAX_IN_PARAMS):
+            batch = missing[start:start + MAX_IN_PARAMS]
+            placeholders = ",".join("?" * len(batch))
+            rows = await self.db.fetchall(
+                f"SELECT thread_id, rating FROM thread_info WHERE thread_id IN ({placeholders})",
+                batch
+            )
+            found = dict(rows)
+            for thread_id in batch:
+                self._ratings[thread_id] = found.get(thread_id)
+        return {thread_id: self._ratings[thread_id] for thread_id in thread_ids}
+
+    async def set(self, thread_id, thread_name, owner_id, rating):
+        await self.db.execute(
+            '''INSERT OR REPLACE INTO thread_info (thread_id, thread_name, owner_id, rating)
+               VALUES (?, ?, ?, ?)''',
+            (thread_id, thread_name, owner_id, rating)
+        )
+        self._ratings[thread_id] = rating
+
+    def invalidate(self, thread_ids):
+        for thread_id in thread_ids:
+            self._ratings.pop(thread_id, None)
+
+
+class GuildPrefixes:
+    """
+    Per-guild command prefixes stored in threads.db, with an in-memory
+    read-through cache since the prefix is needed for every message.
+    """
+
+    def __init__(self, db, default):
+        self.db = db
+        self.default = default
+        # guild_id -> custom prefix, or None for guilds using the default
+        self._prefixes = {}
+
+    async def get(self, guild_id):
+        if guild_id not in self._prefixes:
+            row = await self.db.fetchone("SELECT prefix FROM guild_prefixes WHERE guild_id = ?", (guild_id,))
+            self._prefixes[guild_id] = row[0] if row else None
+        return self._prefixes[guild_id] or self.default
+
+    async def set(self, guild_id, prefix):
+        await self.db.execute(
+            "INSERT OR REPLACE INTO guild_prefixes (guild_id, prefix) VALUES (?, ?)", (guild_id, prefix)
+        )
+        self._prefixes[guild_id] = prefix
+
+    def invalidate(self, guild_ids):
+        for guild_id in guild_ids:
+            self._prefixes.pop(guild_id, None)
+
+
+def setup_shared_state(conn):
+    """
+    Create the tables every shard process shares through threads.db.
+
+    Triggers append each write to thread_info and guild_prefixes to
+    state_changes, whichever process made it, so the other processes can
+    drop the stale entries from their caches (see ChangeFeed). Other sources
+    are added with ChangeFeed.publish; their keys needn't be integers.
+    """
+    with conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS guild_prefixes (
+                            guild_id INTEGER PRIMARY KEY,
+                            prefix TEXT NOT NULL
+                        )''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS state_changes (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            source TEXT NOT NULL,
+                            key INTEGER NOT NULL,
+                            changed INTEGER NOT NULL DEFAULT (strftime('%s', 'now'))
+                        )''')
+        for table, key in (("thread_info", "thread_id"), ("guild_prefixes", "guild_id")):
+            for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+                conn.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_changes AFTER {event} ON {table} "
+                    f"BEGIN INSERT INTO state_changes (source, key) VALUES ('{table}', {row}.{key}); END"
+                )
+
+
+class ChangeFeed:
+    """
+    Polls state_changes and tells subscribers which keys another process
+    (or this one) changed, so read-through caches stay coherent across shards.
+    """
+
+    def __init__(self, db, interval=CHANGE_POLL_INTERVAL):
+        self.db = db
+        self.interval = interval
+        self.last_id = None
+        self._subscribers = {}
+        self._task = None
+
+    def subscribe(self, source, callback):
+        """
+        Call callback(set of keys) whenever rows of `source` change.
+        """
+        self._subscribers.setdefault(source, []).append(callback)
+
+    async def publish(self, source, key):
+        """
+        Announce a change no trigger records, e.g. a cache cleared in memory.
+        """
+        await self.db.execute("INSERT INTO state_changes (source, key) VALUES (?, ?)", (source, key))
+
+    def start(self):
+        """
+        Start polling in the background. Safe to call more than once.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def poll(self):
+        if self.last_id is None:
+            # Only changes from now on matter, the caches start out empty
+            row = await self.db.fetchone("SELECT COALESCE(MAX(id), 0) FROM state_changes")
+            self.last_id = row[0]
+            return 0
+
+        rows = await self.db.fetchall(
+            "SELECT id, source, key FROM state_changes WHERE id > ? ORDER BY id", (self.last_id,)
+        )
+        if not rows:
+            return 0
+        self.last_id = rows[-1][0]
+        changed = {}
+        for _, source, key in rows:
+            changed.setdefault(source, set()).add(key)
+        for source, keys in changed.items():
+            for callback in self._subscribers.get(source, ()):
+                callback(keys)
+        registry.inc("bot_state_changes_total", len(rows))
+        return len(rows)
+
+    async def _run(self):
+        last_prune = 0.0
+        while True:
+            try:
+                await self.poll()
+                if time.time() - last_prune > CHANGE_RETENTION / 24:
+                    await self.db.execute(
+                        "DELETE FROM state_changes WHERE changed < ?", (int(time.time() - CHANGE_RETENTION),)
+                    )
+                    last_prune = time.time()
+            except Exception as e:
+                log.warning("Polling threads.db for changes failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+
+thread_ratings = ThreadRatings(threads_db)
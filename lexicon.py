@@ -0,0 +1,326 @@
+"""
+Strong's lexicon loading and lookup indexes shared by the bot commands.
+"""
+import bisect
+import heapq
+import json
+import logging
+import re
+import unicodedata
+from array import array
+
+import lexicon_store
+
+log = logging.getLogger(__name__)
+
+GREEK_PATH = 'strongs-greek-dictionary.json'
+HEBREW_PATH = 'strongs-hebrew-dictionary.json'
+
+# Compiled binary copies of the dictionaries, see lexicon_store
+GREEK_COMPILED_PATH = 'strongs-greek.lex'
+HEBREW_COMPILED_PATH = 'strongs-hebrew.lex'
+
+# Cached reverse index so a restart doesn't have to rebuild it from the dictionaries
+WORD_INDEX_PATH = 'strongs-word-index.json'
+WORD_INDEX_VERSION = 1
+
+_TOKEN_RE = re.compile(r"\w+")
+
+# Query tokens shorter than this only match whole words, not prefixes
+MIN_PREFIX_LENGTH = 3
+
+
+def load_dictionaries(greek_path=GREEK_PATH, hebrew_path=HEBREW_PATH):
+    """
+    Open the Greek and Hebrew Strong's dictionaries from their compiled,
+    memory-mapped form, compiling them from JSON first if needed.
+    """
+    strongs_greek = lexicon_store.open_dictionary(greek_path, GREEK_COMPILED_PATH)
+    strongs_hebrew = lexicon_store.open_dictionary(hebrew_path, HEBREW_COMPILED_PATH)
+    return strongs_greek, strongs_hebrew
+
+
+def load_json_dictionaries(greek_path=GREEK_PATH, hebrew_path=HEBREW_PATH):
+    """
+    Load the Greek and Hebrew Strong's dictionaries straight from their JSON files.
+    """
+    with open(greek_path, 'r', encoding='utf-8') as f:
+        strongs_greek = json.load(f)
+
+    with open(hebrew_path, 'r', encoding='utf-8') as f:
+        strongs_hebrew = json.load(f)
+
+    return strongs_greek, strongs_hebrew
+
+
+def normalize_term(text):
+    """
+    Normalize a word or dictionary field so lookups compare like with like.
+    """
+    return text.strip().lower().rstrip('.;,')
+
+
+def _prefixed(key, prefix):
+    # Return key as-is if it already starts with the language prefix
+    return key if key.startswith(prefix) else f"{prefix}{key}"
+
+
+def build_word_index(strongs_greek, strongs_hebrew):
+    """
+    Build a reverse index from normalized lemma and kjv_def values to Strong's numbers.
+
+    The first entry to claim a term wins and Greek is indexed before Hebrew,
+    which matches the order the old linear scan in find_strongs used.
+    """
+    index = {}
+    for entries, prefix in ((strongs_greek, "G"), (strongs_hebrew, "H")):
+        for key, value in entries.items():
+            number = _prefixed(key, prefix)
+            for field in ("lemma", "kjv_def"):
+                term = normalize_term(value.get(field, ""))
+                if term:
+                    index.setdefault(term, number)
+    return index
+
+
+def load_word_index(strongs_greek, strongs_hebrew, cache_path=WORD_INDEX_PATH,
+                    source_paths=(GREEK_PATH, HEBREW_PATH)):
+    """
+    Load the reverse word index from the on-disk cache, rebuilding it if the
+    cache is missing or older than the dictionaries it was built from.
+    """
+    try:
+        # Size and mtime of each source file, used to tell if the cached index is stale
+        stamp = [lexicon_store.source_stamp(path) for path in source_paths]
+    except OSError:
+        stamp = None
+
+    if stamp is not None:
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get("version") == WORD_INDEX_VERSION and cached.get("source") == stamp:
+                return cached["index"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    index = build_word_index(strongs_greek, strongs_hebrew)
+
+    if stamp is not None:
+        try:
+            with lexicon_store.replace_atomically(cache_path, 'w', encoding='utf-8') as f:
+                json.dump({"version": WORD_INDEX_VERSION, "source": stamp, "index": index},
+                          f, ensure_ascii=False)
+        except OSError as e:
+            log.warning("Could not write Strong's word index cache: %s", e)
+
+    return index
+
+
+# Field weights for search ranking; headword matches count more than definition text
+SEARCH_FIELDS = (
+    ("lemma", 3),
+    ("translit", 3),
+    ("xlit", 3),
+    ("kjv_def", 2),
+    ("strongs_def", 1),
+)
+
+
+def fold_text(text):
+    """
+    Lowercase and strip accents/vowel points so "agape" finds "agápē".
+    """
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(fold_text(text))
+
+
+class SearchIndex:
+    """
+    Tokenized inverted index over the lemma, transliteration and definition
+    fields of the Strong's dictionaries.
+    """
+
+    def __init__(self, dictionaries):
+        # dictionaries is a sequence of (language prefix, entries) pairs
+        self.docs = []
+        self.postings = {}
+        for prefix, entries in dictionaries:
+            for key, entry in entries.items():
+                doc_id = len(self.docs)
+                self.docs.append((_prefixed(key, prefix), prefix))
+                for field, weight in SEARCH_FIELDS:
+                    for token in tokenize(entry.get(field, "")):
+                        posting = self.postings.setdefault(token, {})
+                        if posting.get(doc_id, 0) < weight:
+                            posting[doc_id] = weight
+        self.vocab = sorted(self.postings)
+
+    def _token_scores(self, token):
+        # Exact token hits score double, prefix hits ("love" -> "loved") score once
+        scores = {}
+        if len(token) < MIN_PREFIX_LENGTH:
+            for doc_id, weight in self.postings.get(token, {}).items():
+                scores[doc_id] = weight * 2
+            return scores
+
+        start = bisect.bisect_left(self.vocab, token)
+        for i in range(start, len(self.vocab)):
+            candidate = self.vocab[i]
+            if not candidate.startswith(token):
+                break
+            factor = 2 if candidate == token else 1
+            for doc_id, weight in self.postings[candidate].items():
+                score = weight * factor
+                if scores.get(doc_id, 0) < score:
+                    scores[doc_id] = score
+        return scores
+
+    def search(self, query, languages=None, limit=10):
+        """
+        Return (total hits, top `limit` Strong's numbers) for every query token.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return 0, []
+
+        per_token = [self._token_scores(token) for token in dict.fromkeys(tokens)]
+        per_token.sort(key=len)
+
+        # Intersect starting from the rarest token and stop as soon as nothing is left
+        candidates = set(per_token[0])
+        if languages is not None:
+            candidates = {d for d in candidates if self.docs[d][1] in languages}
+        for scores in per_token[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(scores)
+
+        if not candidates:
+            return 0, []
+
+        top = heapq.nsmallest(
+            limit, candidates,
+            key=lambda d: (-sum(scores[d] for scores in per_token), d)
+        )
+        return len(candidates), [self.docs[d][0] for d in top]
+
+
+# Strong's numbers inside free text, e.g. "G1537", "(H08012);" or "H1254a"
+_STRONGS_REF_RE = re.compile(r"\b([GH])0*(\d+)[A-Za-z]?\b")
+
+
+def normalize_strongs_number(text):
+    """
+    Canonical form of a Strong's number: "h08012" -> "H8012". Returns None if text isn't one.
+    """
+    match = _STRONGS_REF_RE.fullmatch(text.strip().upper().rstrip(".,;:)").lstrip("("))
+    if not match:
+        return None
+    return f"{match.group(1)}{match.group(2)}"
+
+
+def strongs_references(text):
+    """
+    Every Strong's number mentioned in text, normalized and in order, without duplicates.
+    """
+    return list(dict.fromkeys(f"{prefix}{digits}" for prefix, digits in _STRONGS_REF_RE.findall(text)))
+
+
+def _adjacency(node_count, edges):
+    # Compressed sparse rows: targets of node i are targets[offsets[i]:offsets[i + 1]]
+    offsets = array('I', [0]) * (node_count + 1)
+    for source, _ in edges:
+        offsets[source + 1] += 1
+    for i in range(node_count):
+        offsets[i + 1] += offsets[i]
+    targets = array('I', [0]) * len(edges)
+    fill = array('I', offsets)
+    for source, target in edges:
+        targets[fill[source]] = target
+        fill[source] += 1
+    return offsets, targets
+
+
+class DerivationGraph:
+    """
+    Derivation links between Strong's entries, built once from both dictionaries.
+
+    "Parents" are the numbers an entry's derivation says it comes from;
+    "children" are the entries derived from it. Both directions are stored as
+    compact adjacency arrays over integer node ids.
+    """
+
+    def __init__(self, dictionaries):
+        self.numbers = []
+        self.ids = {}
+        edges = set()
+        for prefix, entries in dictionaries:
+            for key, entry in entries.items():
+                child = self._node(normalize_strongs_number(key) or _prefixed(key, prefix))
+                for parent in strongs_references(entry.get("derivation") or ""):
+                    parent = self._node(parent)
+                    if parent != child:
+                        edges.add((child, parent))
+
+        edges = sorted(edges)
+        self.parent_offsets, self.parent_targets = _adjacency(len(self.numbers), edges)
+        self.child_offsets, self.child_targets = _adjacency(
+            len(self.numbers), sorted((parent, child) for child, parent in edges)
+        )
+
+    def _node(self, number):
+        node = self.ids.get(number)
+        if node is None:
+            node = self.ids[number] = len(self.numbers)
+            self.numbers.append(number)
+        return node
+
+    def __contains__(self, number):
+        return number in self.ids
+
+    def _neighbours(self, offsets, targets, node):
+        return targets[offsets[node]:offsets[node + 1]]
+
+    def parents(self, number):
+        node = self.ids.get(number)
+        if node is None:
+            return []
+        return [self.numbers[n] for n in self._neighbours(self.parent_offsets, self.parent_targets, node)]
+
+    def children(self, number):
+        node = self.ids.get(number)
+        if node is None:
+            return []
+        return [self.numbers[n] for n in self._neighbours(self.child_offsets, self.child_targets, node)]
+
+    def _walk(self, number, hops, offsets, targets):
+        # Breadth-first, returns one list of numbers per hop
+        start = self.ids.get(number)
+        if start is None:
+            return []
+        seen = {start}
+        frontier = [start]
+        levels = []
+        for _ in range(hops):
+            next_frontier = []
+            for node in frontier:
+                for neighbour in self._neighbours(offsets, targets, node):
+                    if neighbour not in seen:
+                        seen.add(neighbour)
+                        next_frontier.append(neighbour)
+            if not next_frontier:
+                break
+            levels.append([self.numbers[n] for n in next_frontier])
+            frontier = next_frontier
+        return levels
+
+    def ancestors(self, number, hops=2):
+        return self._walk(number, hops, self.parent_offsets, self.parent_targets)
+
+    def descendants(self, number, hops=2):
+        return self._walk(number, hops, self.child_offsets, self.child_targets)
@@ -0,0 +1,244 @@
+"""
+Compact binary storage for the Strong's dictionaries.
+
+The JSON dictionaries are compiled once into an indexed binary file which the
+bot opens with mmap. Entries are only decoded when they are looked up, so
+startup doesn't pay for parsing ~3 MB of JSON into nested dicts.
+
+File layout (all integers little-endian):
+    magic         8 bytes  b"STRONGS1"
+    stamp length  u32, followed by the JSON source stamp
+    entry count   u32
+    key table     count x (8-byte key, u32 record offset), sorted by key
+    records       in source order: u8 key length, key, one u32 length per
+                  field (MISSING for absent fields), then the UTF-8 field data
+"""
+import contextlib
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"STRONGS1"
+FIELDS = ("lemma", "translit", "xlit", "pron", "derivation", "strongs_def", "kjv_def")
+KEY_SIZE = 8
+MISSING = 0xFFFFFFFF
+
+_U32 = struct.Struct("<I")
+_SLOT = struct.Struct(f"<{KEY_SIZE}sI")
+_LENGTHS = struct.Struct(f"<{len(FIELDS)}I")
+
+
+class StrongsEntry:
+    """
+    A single decoded dictionary entry. Supports .get() like the old JSON dicts.
+    """
+    __slots__ = FIELDS
+
+    def __init__(self, values):
+        for field, value in zip(FIELDS, values):
+            setattr(self, field, value)
+
+    def get(self, field, default=None):
+        value = getattr(self, field, None) if field in FIELDS else None
+        return default if value is None else value
+
+    def __getitem__(self, field):
+        value = self.get(field)
+        if value is None:
+            raise KeyError(field)
+        return value
+
+
+def source_stamp(path):
+    stat = os.stat(path)
+    return [os.path.basename(path), stat.st_size, int(stat.st_mtime)]
+
+
+@contextlib.contextmanager
+def replace_atomically(path, mode='wb', **kwargs):
+    """
+    Write to a private temporary file next to `path` and move it into place
+    once complete, so processes building the same file at once never see or
+    delete each other's half-written copies.
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), prefix=os.path.basename(path) + ".", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, mode, **kwargs) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+        raise
+
+
+def compile_dictionary(json_path, out_path):
+    """
+    Compile one Strong's JSON dictionary into the binary format.
+    """
+    with open(json_path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+
+    stamp = json.dumps(source_stamp(json_path)).encode('utf-8')
+
+    records = bytearray()
+    slots = []
+    for key, entry in entries.items():
+        key_bytes = key.encode('ascii')
+        if len(key_bytes) > KEY_SIZE:
+            raise ValueError(f"Strong's number too long for the key table: {key}")
+        slots.append((key_bytes, len(records)))
+
+        values = [entry.get(field) for field in FIELDS]
+        encoded = [value.encode('utf-8') if value is not None else b"" for value in values]
+        lengths = [len(data) if value is not None else MISSING for data, value in zip(encoded, values)]
+
+        records += bytes([len(key_bytes)]) + key_bytes
+        records += _LENGTHS.pack(*lengths)
+        for data in encoded:
+            records += data
+
+    slots.sort()
+    header_size = len(MAGIC) + _U32.size + len(stamp) + _U32.size + _SLOT.size * len(slots)
+
+    with replace_atomically(out_path) as f:
+        f.write(MAGIC)
+        f.write(_U32.pack(len(stamp)))
+        f.write(stamp)
+        f.write(_U32.pack(len(slots)))
+        for key_bytes, offset in slots:
+            f.write(_SLOT.pack(key_bytes, header_size + offset))
+        f.write(records)
+    return len(slots)
+
+
+class Lexicon:
+    """
+    Read-only, memory-mapped view of a compiled dictionary that behaves like
+    the {number: entry} dict the bot used to load from JSON.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a compiled Strong's dictionary")
+        pos = len(MAGIC)
+        (stamp_length,) = _U32.unpack_from(self._map, pos)
+        pos += _U32.size
+        self.stamp = json.loads(self._map[pos:pos + stamp_length].decode('utf-8'))
+        pos += stamp_length
+        (self._count,) = _U32.unpack_from(self._map, pos)
+        self._table = pos + _U32.size
+        self._data = self._table + _SLOT.size * self._count
+
+        # Only entries that have actually been looked up are kept decoded
+        self._decoded = {}
+
+    def _find(self, key):
+        # Binary search the sorted key table directly in the mapped file
+        try:
+            target = key.encode('ascii').ljust(KEY_SIZE, b"\0")
+        except UnicodeEncodeError:
+            return None
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            slot_key, offset = _SLOT.unpack_from(self._map, self._table + mid * _SLOT.size)
+            if slot_key < target:
+                lo = mid + 1
+            elif slot_key > target:
+                hi = mid
+            else:
+                return offset
+        return None
+
+    def _decode(self, offset):
+        # Returns (key, entry, offset of the next record)
+        key_length = self._map[offset]
+        key = self._map[offset + 1:offset + 1 + key_length].decode('ascii')
+        pos = offset + 1 + key_length
+        lengths = _LENGTHS.unpack_from(self._map, pos)
+        pos += _LENGTHS.size
+        values = []
+        for length in lengths:
+            if length == MISSING:
+                values.append(None)
+            else:
+                values.append(self._map[pos:pos + length].decode('utf-8'))
+                pos += length
+        return key, StrongsEntry(values), pos
+
+    def get(self, key, default=None):
+        entry = self._decoded.get(key)
+        if entry is not None:
+            return entry
+        offset = self._find(key)
+        if offset is None:
+            return default
+        entry = self._decode(offset)[1]
+        self._decoded[key] = entry
+        return entry
+
+    def __getitem__(self, key):
+        entry = self.get(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry
+
+    def __contains__(self, key):
+        return key in self._decoded or self._find(key) is not None
+
+    def __len__(self):
+        return self._count
+
+    def items(self):
+        """
+        Walk every entry in source order without keeping them decoded.
+        """
+        pos = self._data
+        end = len(self._map)
+        while pos < end:
+            key, entry, pos = self._decode(pos)
+            yield key, entry
+
+    def keys(self):
+        for key, _ in self.items():
+            yield key
+
+    def close(self):
+        self._decoded.clear()
+        self._map.close()
+
+
+def open_dictionary(json_path, compiled_path):
+    """
+    Open the compiled dictionary, rebuilding it first if it is missing or
+    older than its JSON source.
+    """
+    try:
+        lexicon = Lexicon(compiled_path)
+    except (OSError, ValueError):
+        lexicon = None
+
+    if lexicon is not None:
+        try:
+            if lexicon.stamp == source_stamp(json_path):
+                return lexicon
+        except OSError:
+            # No JSON source to compare against, trust the compiled file
+            return lexicon
+        lexicon.close()
+
+    count = compile_dictionary(json_path, compiled_path)
+    log.info("Compiled %d entries from %s into %s", count, json_path, compiled_path)
+    return Lexicon(compiled_path)
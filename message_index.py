@@ -0,0 +1,80 @@
+"""
+Bounded per-channel record of the bot's own messages and command messages,
+filled from on_message, so !clear can delete exactly those by id instead of
+scanning channel history.
+
+Each channel keeps a ring buffer of its most recent CHANNEL_CAPACITY ids;
+the least recently active channels are forgotten past MAX_CHANNELS.
+"""
+import time
+from collections import OrderedDict, deque
+
+CHANNEL_CAPACITY = 500
+MAX_CHANNELS = 2000
+
+# Discord only bulk-deletes messages younger than 14 days; keep a margin for clock skew
+BULK_DELETE_MAX_AGE = 14 * 24 * 60 * 60 - 60
+BULK_DELETE_LIMIT = 100
+
+DISCORD_EPOCH_MS = 1420070400000
+
+
+def snowflake_time(message_id):
+    """
+    Creation time of a Discord id, in seconds since the Unix epoch.
+    """
+    return ((message_id >> 22) + DISCORD_EPOCH_MS) / 1000
+
+
+def split_by_age(message_ids, now=None):
+    """
+    Split ids into (young enough to bulk-delete, too old for bulk delete).
+    """
+    cutoff = (now or time.time()) - BULK_DELETE_MAX_AGE
+    young = [message_id for message_id in message_ids if snowflake_time(message_id) > cutoff]
+    old = [message_id for message_id in message_ids if snowflake_time(message_id) <= cutoff]
+    return young, old
+
+
+def chunks(items, size=BULK_DELETE_LIMIT):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class MessageIndex:
+    def __init__(self, capacity=CHANNEL_CAPACITY, max_channels=MAX_CHANNELS):
+        self.capacity = capacity
+        self.max_channels = max_channels
+        self._channels = OrderedDict()
+
+    def add(self, channel_id, message_id):
+        ids = self._channels.get(channel_id)
+        if ids is None:
+            ids = self._channels[channel_id] = deque(maxlen=self.capacity)
+            if len(self._channels) > self.max_channels:
+                self._channels.popitem(last=False)
+        else:
+            self._channels.move_to_end(channel_id)
+        ids.append(message_id)
+
+    def recent(self, channel_id, limit):
+        """
+        Up to `limit` recorded ids for a channel, newest first.
+        """
+        if limit < 1:
+            return []
+        ids = self._channels.get(channel_id, ())
+        return sorted(ids, reverse=True)[:limit]
+
+    def discard(self, channel_id, message_ids):
+        ids = self._channels.get(channel_id)
+        if not ids:
+            return
+        gone = set(message_ids)
+        kept = [message_id for message_id in ids if message_id not in gone]
+        if len(kept) != len(ids):
+            ids.clear()
+            ids.extend(kept)
+
+    def __len__(self):
+        return sum(len(ids) for ids in self._channels.values())
@@ -0,0 +1,221 @@
+"""
+In-process metrics for the bot: counters, latency histograms and gauges,
+exported as Prometheus text or JSON.
+
+Everything lives in the module-level `registry`. Other modules record into
+it directly (registry.inc(...), registry.observe(...)) and can register
+gauge callbacks for values they already track, like cache hit counters.
+"""
+import bisect
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+# Latency histogram buckets in seconds, same spirit as the Prometheus client defaults
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Recent samples kept per histogram for percentile estimates
+RESERVOIR_SIZE = 2048
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    inner = ",".join(f'{name}="{str(value)}"' for name, value in pairs)
+    return "{" + inner + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+        self.recent.append(value)
+
+    def percentile(self, fraction):
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def gauge(self, name, callback):
+        """
+        Register a callback read at export time. It returns either a plain
+        number or a list of (labels dict, value) pairs.
+        """
+        self._gauges[name] = callback
+
+    def timer(self, name, **labels):
+        return _Timer(self, name, labels)
+
+    def counter_value(self, name, **labels):
+        return self._counters.get((name, _label_key(labels)), 0)
+
+    def histograms(self, name):
+        """
+        Return {labels dict as tuple: Histogram} for one metric name.
+        """
+        with self._lock:
+            return {key: h for (n, key), h in self._histograms.items() if n == name}
+
+    def _gauge_values(self):
+        values = {}
+        for name, callback in self._gauges.items():
+            try:
+                result = callback()
+            except Exception:
+                continue
+            if isinstance(result, list):
+                values[name] = {_label_key(labels): value for labels, value in result}
+            else:
+                values[name] = {(): result}
+        return values
+
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: h for key, h in self._histograms.items()}
+
+            seen = set()
+            for (name, key), value in sorted(counters.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} counter")
+                    seen.add(name)
+                lines.append(f"{name}{_format_labels(key)} {value}")
+
+            for (name, key), h in sorted(histograms.items(), key=lambda item: item[0]):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} histogram")
+                    seen.add(name)
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {h.count}")
+                lines.append(f"{name}_sum{_format_labels(key)} {h.total}")
+                lines.append(f"{name}_count{_format_labels(key)} {h.count}")
+
+        for name, series in sorted(self._gauge_values().items()):
+            lines.append(f"# TYPE {name} gauge")
+            for key, value in series.items():
+                lines.append(f"{name}{_format_labels(key)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(key), "value": value}
+                for (name, key), value in self._counters.items()
+            ]
+            histograms = [
+                {
+                    "name": name, "labels": dict(key), "count": h.count, "sum": h.total,
+                    "p50": h.percentile(0.50), "p95": h.percentile(0.95), "p99": h.percentile(0.99),
+                }
+                for (name, key), h in self._histograms.items()
+            ]
+        gauges = [
+            {"name": name, "labels": dict(key), "value": value}
+            for name, series in self._gauge_values().items()
+            for key, value in series.items()
+        ]
+        return {"counters": counters, "histograms": histograms, "gauges": gauges}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+
+class _Timer:
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class SampleFilter(logging.Filter):
+    """
+    Let through only a fraction of records below `level`, so chatty debug
+    logging doesn't cost much when it is turned on in production.
+    """
+
+    def __init__(self, rate, level=logging.INFO):
+        super().__init__()
+        self.rate = rate
+        self.level = level
+
+    def filter(self, record):
+        if record.levelno >= self.level:
+            return True
+        return random.random() < self.rate
+
+
+async def start_http_server(host, port):
+    """
+    Serve /metrics (Prometheus text) and /metrics.json over aiohttp, which
+    discord.py already depends on.
+    """
+    from aiohttp import web
+
+    async def prometheus(request):
+        return web.Response(text=registry.render_prometheus(), content_type="text/plain")
+
+    async def json_dump(request):
+        return web.Response(text=registry.to_json(), content_type="application/json")
+
+    app = web.Application()
+    app.router.add_get("/metrics", prometheus)
+    app.router.add_get("/metrics.json", json_dump)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner
+
+
+registry = Registry()
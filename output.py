@@ -0,0 +1,128 @@
+"""
+Shared output pipeline: turns a stream of result blocks (verses, search hits,
+thread entries) into as few Discord messages as possible.
+
+Blocks are packed whole whenever they fit. A block that is too long on its own
+is split on a line break, then a space, and never inside a markdown link.
+
+Short output goes out as a plain message. Anything longer is packed into
+embeds, because one message can carry 6000 characters of embeds, three times
+what plain content allows. A 150-verse chapter then takes a handful of API
+calls instead of a dozen.
+
+A message is either a str (plain content) or a list of str (embed
+descriptions). Both are JSON-friendly, so the response cache can store them.
+"""
+import itertools
+import re
+
+import discord
+
+MESSAGE_LIMIT = 2000
+EMBEDS_PER_MESSAGE = 10
+EMBED_TOTAL_LIMIT = 6000
+
+_LINK_RE = re.compile(r"\[[^\]\n]*\]\([^)\n]*\)")
+
+
+def _safe_cut(text, limit):
+    """
+    Index to cut an oversized block at: a line break, else a space, never
+    inside a markdown link, and only mid-word when there's no other choice.
+    """
+    cut = text.rfind("\n", 0, limit + 1)
+    if cut <= 0:
+        cut = text.rfind(" ", 0, limit + 1)
+    if cut <= 0:
+        cut = limit
+
+    for match in _LINK_RE.finditer(text):
+        if match.start() >= cut:
+            break
+        if cut < match.end():
+            if match.start() > 0:
+                cut = match.start()
+            break
+    return cut
+
+
+def pack(blocks, header="", limit=MESSAGE_LIMIT):
+    """
+    Lazily pack text blocks into pages of at most `limit` characters,
+    separated by line breaks, without splitting a block unless it alone is
+    over the limit.
+    """
+    current = header
+    for block in blocks:
+        piece = "\n" + block if current else block
+        if len(current) + len(piece) <= limit:
+            current += piece
+            continue
+        if current == header:
+            # Nothing but the header so far, keep it with the oversized block
+            piece = current + piece
+        else:
+            yield current
+            piece = block
+        current = ""
+        while len(piece) > limit:
+            cut = _safe_cut(piece, limit)
+            page = piece[:cut].rstrip()
+            # A cut right after leading whitespace leaves nothing to send
+            if page:
+                yield page
+            piece = piece[cut:].lstrip()
+        current = piece
+    if current.strip():
+        yield current
+
+
+def iter_messages(blocks, header=""):
+    """
+    Pack blocks into messages: one plain message if everything fits,
+    otherwise messages holding as many page-sized embeds as the 6000
+    character embed total allows.
+    """
+    pages = pack(blocks, header, MESSAGE_LIMIT)
+    first = next(pages, None)
+    if first is None:
+        return
+    second = next(pages, None)
+    if second is None:
+        yield first
+        return
+
+    embeds = []
+    size = 0
+    for page in itertools.chain((first, second), pages):
+        if embeds and (len(embeds) == EMBEDS_PER_MESSAGE or size + len(page) > EMBED_TOTAL_LIMIT):
+            yield embeds
+            embeds = []
+            size = 0
+        embeds.append(page)
+        size += len(page)
+    if embeds:
+        yield embeds
+
+
+def build_messages(blocks, header=""):
+    return list(iter_messages(blocks, header))
+
+
+async def send_messages(ctx, messages):
+    """
+    Send messages one after another. Awaiting each send (rather than firing
+    them concurrently) lets discord.py's per-channel rate-limit bucket pace them.
+    """
+    for message in messages:
+        if isinstance(message, str):
+            await ctx.send(message)
+        else:
+            await ctx.send(embeds=[discord.Embed(description=description) for description in message])
+
+
+async def send_blocks(ctx, blocks, header=""):
+    """
+    Stream blocks straight to the channel, sending each message as soon as it is packed.
+    """
+    await send_messages(ctx, iter_messages(blocks, header))
@@ -0,0 +1,276 @@
+"""
+Reaction polls: votes are tallied in memory from reaction events and
+checkpointed to threads.db, so results never need every reaction re-fetched
+over the API and open polls survive a restart.
+
+Vote changes are queued and written in one batch every CHECKPOINT_INTERVAL
+seconds (and whenever a poll closes). Polls with a duration are closed by a
+timer, which is rescheduled from the database on startup.
+"""
+import asyncio
+import json
+import logging
+import re
+import time
+
+from metrics import registry
+
+log = logging.getLogger(__name__)
+
+OPTION_EMOJIS = ('1️⃣', '2️⃣', '3️⃣', '4️⃣', '5️⃣', '6️⃣', '7️⃣', '8️⃣', '9️⃣', '🔟')
+MAX_OPTIONS = len(OPTION_EMOJIS)
+
+CHECKPOINT_INTERVAL = 5.0
+
+# Longest a poll may stay open, in seconds
+MAX_DURATION = 7 * 24 * 60 * 60
+
+_DURATION_RE = re.compile(r"^(\d+)([smhd])$")
+_DURATION_UNITS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+
+def parse_duration(text):
+    """
+    "30m" -> 1800 seconds. Returns None if text isn't a duration.
+    """
+    match = _DURATION_RE.match(text.strip().lower())
+    if not match:
+        return None
+    return int(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
+
+def format_duration(seconds):
+    for unit, size in (("day", 86400), ("hour", 3600), ("minute", 60), ("second", 1)):
+        if seconds >= size or unit == "second":
+            count = round(seconds / size)
+            return f"{count} {unit}{'s' if count != 1 else ''}"
+
+
+class Poll:
+    def __init__(self, message_id, channel_id, guild_id, question, options, closes_at=None, closed=False):
+        self.message_id = message_id
+        self.channel_id = channel_id
+        self.guild_id = guild_id
+        self.question = question
+        self.options = options
+        self.closes_at = closes_at
+        self.closed = closed
+        # One set of voter ids per option; reacting twice with the same emoji is one vote
+        self.voters = [set() for _ in options]
+
+    def option_for(self, emoji):
+        try:
+            index = OPTION_EMOJIS.index(emoji)
+        except ValueError:
+            return None
+        return index if index < len(self.options) else None
+
+    def counts(self):
+        return [len(voters) for voters in self.voters]
+
+    def summary(self, now=None):
+        """
+        Result text: one line per option with its votes and share.
+        """
+        counts = self.counts()
+        total = sum(counts)
+        if self.closed:
+            status = "closed"
+        elif self.closes_at:
+            status = f"closes in {format_duration(max(0, self.closes_at - (now or time.time())))}"
+        else:
+            status = "open"
+        lines = [f"**Poll: {self.question}** ({status}, {total} vote{'s' if total != 1 else ''})"]
+        for emoji, option, count in zip(OPTION_EMOJIS, self.options, counts):
+            share = count / total if total else 0.0
+            bar = "▓" * round(share * 10) + "░" * (10 - round(share * 10))
+            lines.append(f"{emoji} {option}: {bar} {count} ({share:.0%})")
+        return "\n".join(lines)
+
+
+def setup(conn):
+    with conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS polls (
+                            message_id INTEGER PRIMARY KEY,
+                            channel_id INTEGER NOT NULL,
+                            guild_id INTEGER,
+                            question TEXT NOT NULL,
+                            options TEXT NOT NULL,
+                            closes_at REAL,
+                            closed INTEGER NOT NULL DEFAULT 0
+                        )''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS poll_votes (
+                            message_id INTEGER NOT NULL,
+                            user_id INTEGER NOT NULL,
+                            option INTEGER NOT NULL,
+                            PRIMARY KEY (message_id, user_id, option)
+                        ) WITHOUT ROWID''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_polls_channel ON polls (channel_id, message_id)")
+
+
+def _load_open(conn):
+    polls = conn.execute(
+        "SELECT message_id, channel_id, guild_id, question, options, closes_at FROM polls WHERE closed = 0"
+    ).fetchall()
+    votes = conn.execute(
+        "SELECT v.message_id, v.user_id, v.option FROM poll_votes v "
+        "JOIN polls p ON p.message_id = v.message_id WHERE p.closed = 0"
+    ).fetchall()
+    return polls, votes
+
+
+def _write_votes(conn, changes):
+    # Changes are applied in order, so a vote removed and re-added ends up stored
+    with conn:
+        for added, message_id, user_id, option in changes:
+            if added:
+                conn.execute("INSERT OR IGNORE INTO poll_votes (message_id, user_id, option) VALUES (?, ?, ?)",
+                             (message_id, user_id, option))
+            else:
+                conn.execute("DELETE FROM poll_votes WHERE message_id = ? AND user_id = ? AND option = ?",
+                             (message_id, user_id, option))
+
+
+def _load_poll(conn, message_id):
+    row = conn.execute(
+        "SELECT message_id, channel_id, guild_id, question, options, closes_at, closed FROM polls WHERE message_id = ?",
+        (message_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    poll = Poll(*row[:4], json.loads(row[4]), row[5], bool(row[6]))
+    for user_id, option in conn.execute(
+        "SELECT user_id, option FROM poll_votes WHERE message_id = ?", (message_id,)
+    ):
+        if option < len(poll.voters):
+            poll.voters[option].add(user_id)
+    return poll
+
+
+class PollTracker:
+    def __init__(self, db, on_close=None, checkpoint_interval=CHECKPOINT_INTERVAL, owns_guild=None):
+        self.db = db
+        # Awaited with the Poll when its timer closes it, to post the results
+        self.on_close = on_close
+        # guild_id -> whether this process handles that guild's events; with several
+        # shard processes, each loads and closes only its own guilds' polls
+        self.owns_guild = owns_guild
+        self.checkpoint_interval = checkpoint_interval
+        # message_id -> Poll, open polls only
+        self.polls = {}
+        self._changes = []
+        self._timers = {}
+        self._task = None
+
+    def start(self):
+        """
+        Load open polls, reschedule their timers and start checkpointing. Safe to call more than once.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def _run(self):
+        polls, votes = await self.db.run(_load_open)
+        if self.owns_guild is not None:
+            polls = [row for row in polls if self.owns_guild(row[2])]
+        for message_id, channel_id, guild_id, question, options, closes_at in polls:
+            poll = Poll(message_id, channel_id, guild_id, question, json.loads(options), closes_at)
+            self.polls.setdefault(message_id, poll)
+            self._schedule(poll)
+        for message_id, user_id, option in votes:
+            poll = self.polls.get(message_id)
+            if poll is not None and option < len(poll.voters):
+                poll.voters[option].add(user_id)
+        if polls:
+            log.info("Loaded %d open polls", len(polls))
+
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            try:
+                await self.checkpoint()
+            except Exception as e:
+                log.warning("Checkpointing poll votes failed: %s", e)
+
+    async def checkpoint(self):
+        changes, self._changes = self._changes, []
+        if changes:
+            try:
+                await self.db.run(_write_votes, changes)
+            except Exception:
+                # Keep them for the next checkpoint, ahead of any votes queued meanwhile
+                self._changes[:0] = changes
+                raise
+        return len(changes)
+
+    async def create(self, message_id, channel_id, guild_id, question, options, duration=None):
+        poll = Poll(message_id, channel_id, guild_id, question, list(options),
+                    time.time() + duration if duration else None)
+        await self.db.execute(
+            "INSERT INTO polls (message_id, channel_id, guild_id, question, options, closes_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (message_id, channel_id, guild_id, question, json.dumps(poll.options, ensure_ascii=False), poll.closes_at)
+        )
+        self.polls[message_id] = poll
+        self._schedule(poll)
+        return poll
+
+    def vote(self, message_id, user_id, emoji, added):
+        """
+        Record a reaction add/remove. Returns False if it isn't a vote on an open poll.
+        """
+        poll = self.polls.get(message_id)
+        if poll is None:
+            return False
+        option = poll.option_for(emoji)
+        if option is None:
+            return False
+        voters = poll.voters[option]
+        if added == (user_id in voters):
+            return False
+        if added:
+            voters.add(user_id)
+        else:
+            voters.discard(user_id)
+        self._changes.append((added, message_id, user_id, option))
+        registry.inc("bot_poll_votes_total", change="add" if added else "remove")
+        return True
+
+    async def get(self, message_id):
+        """
+        An open poll from memory, or a closed one from the database.
+        """
+        poll = self.polls.get(message_id)
+        if poll is None:
+            poll = await self.db.run(_load_poll, message_id)
+        return poll
+
+    async def latest_in_channel(self, channel_id):
+        row = await self.db.fetchone(
+            "SELECT message_id FROM polls WHERE channel_id = ? ORDER BY message_id DESC LIMIT 1", (channel_id,)
+        )
+        return await self.get(row[0]) if row else None
+
+    async def close(self, message_id):
+        poll = self.polls.pop(message_id, None)
+        if poll is None:
+            return None
+        timer = self._timers.pop(message_id, None)
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+        poll.closed = True
+        await self.checkpoint()
+        await self.db.execute("UPDATE polls SET closed = 1 WHERE message_id = ?", (message_id,))
+        return poll
+
+    def _schedule(self, poll):
+        if poll.closes_at is not None and poll.message_id not in self._timers:
+            self._timers[poll.message_id] = asyncio.create_task(self._close_later(poll))
+
+    async def _close_later(self, poll):
+        await asyncio.sleep(max(0.0, poll.closes_at - time.time()))
+        closed = await self.close(poll.message_id)
+        if closed is not None and self.on_close is not None:
+            try:
+                await self.on_close(closed)
+            except Exception as e:
+                log.warning("Posting results for poll %s failed: %s", poll.message_id, e)
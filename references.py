@@ -0,0 +1,383 @@
+"""
+Verse reference parsing for !bible.
+
+Book names and abbreviations are compiled once into a trie, so "john",
+"jn", "1co", "1 cor." and "song of solomon" all resolve without rebuilding
+anything per request. Unique prefixes ("gen", "rev") are accepted and a
+small edit-distance fallback catches typos ("jhon", "pslams").
+
+A reference string can hold several references:
+
+    john 3:16                single verse
+    john 3:16-18             verse range
+    john 3:16-4:2            range across chapters
+    psalm 23                 whole chapter
+    john 3-4                 several whole chapters
+    jude 3                   verse of a one-chapter book
+    john 3:16,18; rom 5:8    lists, with ";" or "," between references
+    john 3:16; 4:1           later references without a book reuse the last one
+"""
+import re
+from collections import namedtuple
+
+BOOKS = (
+    "Genesis", "Exodus", "Leviticus", "Numbers", "Deuteronomy", "Joshua", "Judges", "Ruth",
+    "1 Samuel", "2 Samuel", "1 Kings", "2 Kings", "1 Chronicles", "2 Chronicles", "Ezra",
+    "Nehemiah", "Esther", "Job", "Psalms", "Proverbs", "Ecclesiastes", "Song of Solomon",
+    "Isaiah", "Jeremiah", "Lamentations", "Ezekiel", "Daniel", "Hosea", "Joel", "Amos",
+    "Obadiah", "Jonah", "Micah", "Nahum", "Habakkuk", "Zephaniah", "Haggai", "Zechariah",
+    "Malachi", "Matthew", "Mark", "Luke", "John", "Acts", "Romans", "1 Corinthians",
+    "2 Corinthians", "Galatians", "Ephesians", "Philippians", "Colossians", "1 Thessalonians",
+    "2 Thessalonians", "1 Timothy", "2 Timothy", "Titus", "Philemon", "Hebrews", "James",
+    "1 Peter", "2 Peter", "1 John", "2 John", "3 John", "Jude", "Revelation",
+)
+
+# Extra names per book number; the full name itself is always accepted
+ALIASES = {
+    1: ("gen", "ge", "gn"),
+    2: ("exod", "exo", "ex"),
+    3: ("lev", "le", "lv"),
+    4: ("num", "nu", "nm", "nb"),
+    5: ("deut", "de", "dt"),
+    6: ("josh", "jos", "jsh"),
+    7: ("judg", "jdg", "jg", "jdgs"),
+    8: ("rth", "ru"),
+    9: ("1sam", "1sa", "1sm"),
+    10: ("2sam", "2sa", "2sm"),
+    11: ("1kgs", "1ki", "1kin"),
+    12: ("2kgs", "2ki", "2kin"),
+    13: ("1chr", "1ch", "1chron"),
+    14: ("2chr", "2ch", "2chron"),
+    15: ("ezr",),
+    16: ("neh", "ne"),
+    17: ("esth", "est", "es"),
+    18: ("jb",),
+    19: ("ps", "psa", "psalm", "pss", "psm"),
+    20: ("prov", "pro", "prv", "pr"),
+    21: ("eccl", "ecc", "ec", "qoh"),
+    22: ("song", "sos", "so", "songofsongs", "canticles", "cant", "sng"),
+    23: ("isa", "is"),
+    24: ("jer", "je", "jr"),
+    25: ("lam", "la"),
+    26: ("ezek", "eze", "ezk"),
+    27: ("dan", "da", "dn"),
+    28: ("hos", "ho"),
+    29: ("jl",),
+    30: ("am",),
+    31: ("obad", "ob"),
+    32: ("jon", "jnh"),
+    33: ("mic", "mc"),
+    34: ("nah", "na"),
+    35: ("hab", "hb"),
+    36: ("zeph", "zep", "zp"),
+    37: ("hag", "hg"),
+    38: ("zech", "zec", "zc"),
+    39: ("mal", "ml"),
+    40: ("matt", "mat", "mt"),
+    41: ("mrk", "mk", "mr"),
+    42: ("luk", "lk"),
+    43: ("jn", "jhn", "joh"),
+    44: ("act", "ac"),
+    45: ("rom", "ro", "rm"),
+    46: ("1cor", "1co"),
+    47: ("2cor", "2co"),
+    48: ("gal", "ga"),
+    49: ("eph", "ephes"),
+    50: ("phil", "php", "pp"),
+    51: ("col",),
+    52: ("1thess", "1thes", "1th"),
+    53: ("2thess", "2thes", "2th"),
+    54: ("1tim", "1ti"),
+    55: ("2tim", "2ti"),
+    56: ("tit", "ti"),
+    57: ("philem", "phm", "pm"),
+    58: ("heb",),
+    59: ("jas", "jm"),
+    60: ("1pet", "1pe", "1pt", "1p"),
+    61: ("2pet", "2pe", "2pt", "2p"),
+    62: ("1jn", "1jo", "1jhn", "1joh"),
+    63: ("2jn", "2jo", "2jhn", "2joh"),
+    64: ("3jn", "3jo", "3jhn", "3joh"),
+    65: ("jud", "jd"),
+    66: ("rev", "re", "revelations", "apocalypse"),
+}
+
+# Books with a single chapter, where "jude 3" means verse 3
+SINGLE_CHAPTER_BOOKS = {31, 57, 63, 64, 65}
+
+# Stand-in for "to the end of the chapter"
+LAST_VERSE = 999
+
+# Largest chapter and verse numbers in any book (Psalm 150, Psalm 119:176)
+MAX_CHAPTER = 150
+MAX_VERSE = 176
+
+# Average chapter length in the KJV (31,102 verses in 1,189 chapters), to size whole-chapter ranges
+AVERAGE_CHAPTER_VERSES = 26
+
+USAGE = "Invalid reference format. Use BOOK CHAPTER:VERSE or BOOK CHAPTER:VERSE-VERSE."
+
+_ROMAN_PREFIXES = {"i": "1", "ii": "2", "iii": "3"}
+_REFERENCE_RE = re.compile(r"^(?P<book>(?:[1-3]\s*)?[a-z][a-z.\s]*?)\s*(?P<spec>\d[\d\s:\-–]*)?$")
+
+
+class ReferenceParseError(ValueError):
+    """
+    Raised for references that can't be parsed; the message is safe to show users.
+    """
+
+
+class VerseRange(namedtuple("VerseRange", "book start_chapter start_verse end_chapter end_verse")):
+    """
+    An inclusive range of verses in one book, possibly spanning chapters.
+    """
+    __slots__ = ()
+
+    @property
+    def single_chapter(self):
+        return self.start_chapter == self.end_chapter
+
+    def estimated_size(self):
+        """
+        Number of verses: exact for an explicit verse range, estimated when whole chapters are involved.
+        """
+        if self.single_chapter and self.end_verse != LAST_VERSE:
+            return self.end_verse - self.start_verse + 1
+        return (self.end_chapter - self.start_chapter + 1) * AVERAGE_CHAPTER_VERSES
+
+    def label(self):
+        name = BOOKS[self.book - 1]
+        if self.single_chapter:
+            if self.start_verse == 1 and self.end_verse == LAST_VERSE:
+                return f"{name} {self.start_chapter}"
+            if self.start_verse == self.end_verse:
+                return f"{name} {self.start_chapter}:{self.start_verse}"
+            return f"{name} {self.start_chapter}:{self.start_verse}-{self.end_verse}"
+        if self.start_verse == 1 and self.end_verse == LAST_VERSE:
+            return f"{name} {self.start_chapter}-{self.end_chapter}"
+        end = f"{self.end_chapter}" if self.end_verse == LAST_VERSE else f"{self.end_chapter}:{self.end_verse}"
+        return f"{name} {self.start_chapter}:{self.start_verse}-{end}"
+
+
+def book_name(book):
+    return BOOKS[book - 1]
+
+
+def resolve_book(text):
+    """
+    Book number for a name, abbreviation, unique prefix or near-miss spelling, or None.
+    """
+    return _book_trie.resolve(text)
+
+
+def _normalize_book(text):
+    words = text.lower().replace(".", " ").split()
+    if len(words) > 1 and words[0] in _ROMAN_PREFIXES:
+        words[0] = _ROMAN_PREFIXES[words[0]]
+    return "".join(words)
+
+
+class _TrieNode:
+    __slots__ = ("children", "book", "books")
+
+    def __init__(self):
+        self.children = {}
+        self.book = None
+        # Every book reachable below this node, to recognise unique prefixes
+        self.books = set()
+
+
+class BookTrie:
+    def __init__(self):
+        self.root = _TrieNode()
+        self.full_names = {}
+        self.aliases = {}
+        for number, name in enumerate(BOOKS, start=1):
+            key = _normalize_book(name)
+            self.full_names[key] = number
+            self.add(key, number)
+            for alias in ALIASES.get(number, ()):
+                self.aliases[alias] = number
+                self.add(alias, number)
+
+    def add(self, key, book):
+        node = self.root
+        node.books.add(book)
+        for char in key:
+            node = node.children.setdefault(char, _TrieNode())
+            node.books.add(book)
+        node.book = book
+
+    def lookup(self, key):
+        """
+        Exact name or alias first, then a prefix shared by only one book.
+        """
+        node = self.root
+        for char in key:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        if node.book is not None:
+            return node.book
+        if len(node.books) == 1:
+            return next(iter(node.books))
+        return None
+
+    def closest(self, key):
+        """
+        Typo fallback: the single name within a small edit distance of key.
+        Full book names are tried before abbreviations, so "jhon" is John
+        rather than a tie with "jon".
+        """
+        if len(key) < 3:
+            return None
+        max_distance = 1 if len(key) <= 5 else 2
+        return (self._closest_in(self.full_names, key, max_distance)
+                or self._closest_in(self.aliases, key, max_distance))
+
+    @staticmethod
+    def _closest_in(names, key, max_distance):
+        best, best_distance, tied = None, max_distance + 1, False
+        for name, book in names.items():
+            if abs(len(name) - len(key)) > max_distance:
+                continue
+            distance = _edit_distance(key, name, max_distance)
+            if distance < best_distance:
+                best, best_distance, tied = book, distance, False
+            elif distance == best_distance and book != best:
+                tied = True
+        return None if tied else best
+
+    def resolve(self, text):
+        key = _normalize_book(text)
+        return self.lookup(key) or self.closest(key)
+
+
+def _edit_distance(a, b, limit):
+    # Edit distance counting a swap of adjacent letters ("jhon") as one edit,
+    # with an early exit once every cell is past `limit`
+    before = None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            cost = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            )
+            if before is not None and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+_book_trie = BookTrie()
+
+
+def _parse_number(text, maximum, kind):
+    text = text.strip()
+    if not text.isdecimal():
+        raise ReferenceParseError(USAGE)
+    # Compare lengths first, so a thousand-digit number is never converted
+    if len(text.lstrip("0")) > len(str(maximum)) or int(text) > maximum:
+        raise ReferenceParseError(f"No book goes past {kind} {maximum}.")
+    value = int(text)
+    if value < 1:
+        raise ReferenceParseError(USAGE)
+    return value
+
+
+def _parse_chapter(text):
+    return _parse_number(text, MAX_CHAPTER, "chapter")
+
+
+def _parse_verse(text):
+    return _parse_number(text, MAX_VERSE, "verse")
+
+
+def _parse_point(text, chapter=None):
+    # "3:16" -> (3, 16); "16" -> (chapter, 16) when a chapter is in context, else (16, None)
+    if ":" in text:
+        chapter_part, verse_part = text.split(":", 1)
+        return _parse_chapter(chapter_part), _parse_verse(verse_part)
+    if chapter is not None:
+        return chapter, _parse_verse(text)
+    return _parse_chapter(text), None
+
+
+def _parse_item(book, item, chapter):
+    """
+    Parse one comma-separated item. `chapter` is the chapter in context when
+    the previous item named verses ("3:16,18"), otherwise None.
+    """
+    item = item.replace("–", "-")
+    if book in SINGLE_CHAPTER_BOOKS and ":" not in item:
+        chapter = 1
+
+    start_text, _, end_text = item.partition("-")
+    start_chapter, start_verse = _parse_point(start_text, chapter)
+
+    if not end_text:
+        if start_verse is None:
+            return VerseRange(book, start_chapter, 1, start_chapter, LAST_VERSE)
+        return VerseRange(book, start_chapter, start_verse, start_chapter, start_verse)
+
+    if start_verse is None:
+        # "3-4": whole chapters
+        end_chapter = _parse_chapter(end_text)
+        end_verse = LAST_VERSE
+        start_verse = 1
+    else:
+        end_chapter, end_verse = _parse_point(end_text, start_chapter)
+        if end_verse is None:
+            end_verse = LAST_VERSE
+
+    if (end_chapter, end_verse) < (start_chapter, start_verse):
+        raise ReferenceParseError("The end of a range can't come before its start.")
+    return VerseRange(book, start_chapter, start_verse, end_chapter, end_verse)
+
+
+def parse(text):
+    """
+    Parse a reference string into a list of VerseRange.
+    """
+    ranges = []
+    book = None
+    chapter = None
+
+    for part in re.split(r"[;,]", text.lower()):
+        part = part.strip()
+        if not part:
+            continue
+
+        if re.search(r"[a-z]", part):
+            match = _REFERENCE_RE.match(part)
+            if not match:
+                raise ReferenceParseError(USAGE)
+            book = _book_trie.resolve(match.group("book"))
+            if book is None:
+                raise ReferenceParseError(f"I don't recognise the book '{match.group('book').strip()}'.")
+            spec = match.group("spec")
+            if not spec:
+                raise ReferenceParseError(USAGE)
+            chapter = None
+        elif book is None:
+            raise ReferenceParseError(USAGE)
+        else:
+            spec = part
+
+        spec = re.sub(r"\s+", "", spec)
+        verse_range = _parse_item(book, spec, chapter)
+        ranges.append(verse_range)
+
+        # A following bare number is a verse in this chapter only if this item named verses
+        named_verse = ":" in spec or (book in SINGLE_CHAPTER_BOOKS)
+        chapter = verse_range.end_chapter if named_verse and verse_range.end_verse != LAST_VERSE else None
+
+    if not ranges:
+        raise ReferenceParseError(USAGE)
+    return ranges
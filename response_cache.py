@@ -0,0 +1,175 @@
+"""
+Cache of finished command responses, keyed on the normalized command and
+arguments, so repeated lookups like "!strongs G26" or "!bible john 3:16"
+skip straight to sending.
+
+The in-memory tier is an LRU bounded by the total size of the cached text
+with a per-entry TTL. An optional SQLite tier keeps entries across restarts.
+"""
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from database import Database
+from metrics import registry
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+DEFAULT_TTL = 60 * 60
+DISK_PATH = 'response_cache.db'
+
+# Stands for every command in invalidations passed between processes
+ALL_COMMANDS = "*"
+
+
+def make_key(command, *args):
+    return json.dumps([command, *args], ensure_ascii=False, separators=(",", ":"))
+
+
+def _size(messages):
+    # A message is plain text or a list of embed descriptions, see output.py
+    return sum(
+        len(message.encode('utf-8')) if isinstance(message, str)
+        else sum(len(part.encode('utf-8')) for part in message)
+        for message in messages
+    )
+
+
+class ResponseCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL, disk_path=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # key -> (expires at, pages, size)
+        self._entries = OrderedDict()
+        self._disk = None
+        if disk_path:
+            self._disk = Database(disk_path, workers=1)
+            self._disk.run_sync(self._setup_disk)
+
+    @staticmethod
+    def _setup_disk(conn):
+        with conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+                                key TEXT PRIMARY KEY,
+                                command TEXT,
+                                pages TEXT,
+                                expires REAL
+                            )''')
+            conn.execute("DELETE FROM responses WHERE expires < ?", (time.time(),))
+
+    def _store(self, key, pages, expires):
+        size = _size(pages)
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old[2]
+        self._entries[key] = (expires, pages, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    async def get(self, command, *args):
+        """
+        Return the cached list of messages, or None.
+        """
+        key = make_key(command, *args)
+        now = time.time()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self._drop(key)
+
+        if self._disk is not None:
+            row = await self._disk.fetchone("SELECT pages, expires FROM responses WHERE key = ?", (key,))
+            if row is not None and row[1] > now:
+                pages = json.loads(row[0])
+                self._store(key, pages, row[1])
+                self.disk_hits += 1
+                return pages
+
+        self.misses += 1
+        return None
+
+    async def put(self, command, messages, *args):
+        key = make_key(command, *args)
+        expires = time.time() + self.ttl
+        self._store(key, messages, expires)
+        if self._disk is not None:
+            await self._disk.execute(
+                "INSERT OR REPLACE INTO responses (key, command, pages, expires) VALUES (?, ?, ?, ?)",
+                (key, command, json.dumps(messages, ensure_ascii=False), expires)
+            )
+
+    def _forget(self, command=None):
+        if command is None:
+            self._entries.clear()
+            self.bytes = 0
+        else:
+            prefix = make_key(command)[:-1] + ","
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                self._drop(key)
+
+    def forget(self, commands):
+        """
+        Drop in-memory responses for the given commands ("*" for all) after
+        another process invalidated them; the disk tier is already cleared.
+        """
+        for command in commands:
+            self._forget(None if command == ALL_COMMANDS else command)
+
+    async def invalidate(self, command=None):
+        """
+        Drop every cached response, or only those for one command. Only this
+        process's memory tier is cleared; ChangeFeed carries it to the others.
+        """
+        self._forget(command)
+        if self._disk is not None:
+            if command is None:
+                await self._disk.execute("DELETE FROM responses")
+            else:
+                await self._disk.execute("DELETE FROM responses WHERE command = ?", (command,))
+
+    def stats(self):
+        return {
+            "entries": len(self._entries), "bytes": self.bytes,
+            "hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+        }
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+
+
+def _metrics(cache):
+    stats = cache.stats()
+    lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+    hit_rate = (stats["hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+    return [
+        ({"cache": "response", "stat": name}, value) for name, value in stats.items()
+    ] + [({"cache": "response", "stat": "hit_rate"}, hit_rate)]
+
+
+def create(max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL, disk_path=DISK_PATH):
+    """
+    Build the bot's response cache and export its stats as metrics.
+    """
+    cache = ResponseCache(max_bytes=max_bytes, ttl=ttl, disk_path=disk_path)
+    registry.gauge("bot_response_cache", lambda: _metrics(cache))
+    return cache
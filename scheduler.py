@@ -0,0 +1,202 @@
+"""
+Admission control and scheduling in front of the command handlers.
+
+Every command has a token cost. Each user and each guild has a token bucket
+that refills at a steady rate; a command only runs if both buckets can pay
+for it, so one user (or one busy guild) can't saturate the bot.
+
+Commands at or above HEAVY_COST run in the heavy lane, which only lets a
+few run at once and turns new ones away once its queue is full. Cheap
+commands skip the lane entirely, so `!ping` or `!strongs G26` never wait
+behind a `!bible -strongs psalms 119`.
+
+Coalescer lets concurrent identical requests share one computation.
+"""
+import asyncio
+import time
+
+from discord.ext import commands
+
+from metrics import registry
+
+# Tokens per second and bucket size, per user and per guild
+USER_RATE = 1.0
+USER_BURST = 10.0
+GUILD_RATE = 5.0
+GUILD_BURST = 40.0
+
+# Commands costing at least this much go through the heavy lane
+HEAVY_COST = 3
+HEAVY_CONCURRENCY = 2
+HEAVY_MAX_WAITING = 8
+
+# Idle buckets are dropped once there are this many, they'd be full anyway
+MAX_BUCKETS = 10000
+
+
+class RateLimited(commands.CheckFailure):
+    def __init__(self, scope, key, retry_after):
+        super().__init__(f"Rate limited per {scope}, retry in {retry_after:.1f}s")
+        self.scope = scope
+        self.key = key
+        self.retry_after = retry_after
+
+
+class Overloaded(commands.CommandError):
+    """
+    Raised when the heavy lane's queue is already full.
+    """
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost, now):
+        """
+        Seconds until `cost` tokens are available, 0 if they are now.
+        """
+        self.refill(now)
+        cost = min(cost, self.capacity)
+        return 0.0 if self.tokens >= cost else (cost - self.tokens) / self.rate
+
+    def take(self, cost):
+        self.tokens -= min(cost, self.capacity)
+
+
+class RateLimiter:
+    """
+    One token bucket per key (user or guild id), created on first use.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+
+    def bucket(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= MAX_BUCKETS:
+                self._prune(now)
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+        return bucket
+
+    def _prune(self, now):
+        for key, bucket in list(self._buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class Scheduler:
+    def __init__(self, user_rate=USER_RATE, user_burst=USER_BURST, guild_rate=GUILD_RATE, guild_burst=GUILD_BURST,
+                 heavy_cost=HEAVY_COST, heavy_concurrency=HEAVY_CONCURRENCY, heavy_max_waiting=HEAVY_MAX_WAITING):
+        self.users = RateLimiter(user_rate, user_burst)
+        self.guilds = RateLimiter(guild_rate, guild_burst)
+        self.heavy_cost = heavy_cost
+        self.heavy_max_waiting = heavy_max_waiting
+        self._heavy = asyncio.Semaphore(heavy_concurrency)
+        self.heavy_running = 0
+        self.heavy_waiting = 0
+        # (scope, key) -> when its current cooldown ends, see should_warn()
+        self._warned = {}
+
+    def admit(self, user_id, guild_id, cost):
+        """
+        Charge a command to its user's and guild's buckets, or raise
+        RateLimited without charging either if one can't pay.
+        """
+        now = time.monotonic()
+        buckets = [("user", user_id, self.users.bucket(user_id, now))]
+        if guild_id is not None:
+            buckets.append(("guild", guild_id, self.guilds.bucket(guild_id, now)))
+        for scope, key, bucket in buckets:
+            retry_after = bucket.wait_time(cost, now)
+            if retry_after:
+                registry.inc("bot_rate_limited_total", scope=scope)
+                raise RateLimited(scope, key, retry_after)
+        for _, _, bucket in buckets:
+            bucket.take(cost)
+
+    def should_warn(self, error):
+        """
+        True the first time a user or guild is rate limited within a cooldown,
+        so a flood of commands gets one warning instead of one reply each.
+        """
+        now = time.monotonic()
+        key = (error.scope, error.key)
+        if self._warned.get(key, 0.0) > now:
+            return False
+        if len(self._warned) >= MAX_BUCKETS:
+            self._warned = {key: until for key, until in self._warned.items() if until > now}
+        self._warned[key] = now + error.retry_after
+        return True
+
+    def is_heavy(self, cost):
+        return cost >= self.heavy_cost
+
+    async def acquire(self, cost):
+        """
+        Wait for a heavy lane slot; cheap commands return straight away.
+        Returns True if a slot was taken and must be given back with release().
+        """
+        if not self.is_heavy(cost):
+            return False
+        if self._heavy.locked() and self.heavy_waiting >= self.heavy_max_waiting:
+            registry.inc("bot_scheduler_rejected_total", lane="heavy")
+            raise Overloaded("The heavy command queue is full")
+        self.heavy_waiting += 1
+        try:
+            with registry.timer("bot_scheduler_wait_seconds", lane="heavy"):
+                await self._heavy.acquire()
+        finally:
+            self.heavy_waiting -= 1
+        self.heavy_running += 1
+        return True
+
+    def release(self):
+        self.heavy_running -= 1
+        self._heavy.release()
+
+    def stats(self):
+        return {
+            "heavy_running": self.heavy_running, "heavy_waiting": self.heavy_waiting,
+            "user_buckets": len(self.users), "guild_buckets": len(self.guilds),
+        }
+
+
+class Coalescer:
+    """
+    Run one computation per key at a time: callers asking for a key that is
+    already in flight wait for the same result instead of starting another.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+
+    async def run(self, key, factory):
+        future = self._in_flight.get(key)
+        if future is not None:
+            registry.inc("bot_coalesced_requests_total")
+        else:
+            future = asyncio.ensure_future(factory())
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # Shielded so one caller giving up doesn't cancel the work for the others
+        return await asyncio.shield(future)
+
+    def __len__(self):
+        return len(self._in_flight)
@@ -0,0 +1,281 @@
+"""
+Process pool for the CPU-bound Strong's work (search, -strongs annotation and
+formatting) so it never runs on the discord.py event loop.
+
+Every worker process loads its own copy of the lexicon and indexes once, in
+the pool initializer. The pool only accepts a bounded number of outstanding
+jobs; past that, submit() raises WorkerPoolBusy so the command can tell the
+user to try again instead of queueing forever.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+import lexicon
+from metrics import registry
+
+log = logging.getLogger(__name__)
+
+# Per-process state, filled in by _init_worker
+_strongs_greek = None
+_strongs_hebrew = None
+_word_index = None
+_search_index = None
+# WordNet is only loaded on the first word that needs lemmatizing, see _lemmatize
+_lemmatizer = None
+
+DEFAULT_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+DEFAULT_MAX_PENDING = 32
+DEFAULT_TIMEOUT = 10.0
+
+# Never fork: by the time the pool starts (or restarts) the bot process is running
+# SQLite, to_thread and discord.py threads, and forking those can deadlock a worker.
+# Windows only has spawn, which re-imports the main module in every worker
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+class WorkerPoolBusy(Exception):
+    """
+    Raised when the pool already has its maximum number of outstanding jobs.
+    """
+
+
+def _init_worker():
+    global _strongs_greek, _strongs_hebrew, _word_index, _search_index
+
+    _strongs_greek, _strongs_hebrew = lexicon.load_dictionaries()
+    _word_index = lexicon.load_word_index(_strongs_greek, _strongs_hebrew)
+    _search_index = lexicon.SearchIndex([("G", _strongs_greek), ("H", _strongs_hebrew)])
+
+
+def wordnet_available():
+    """
+    Whether the WordNet corpus is installed locally. Never downloads anything.
+    """
+    try:
+        import nltk
+    except ImportError:
+        return False
+    for resource in ("corpora/wordnet", "corpora/wordnet.zip"):
+        try:
+            nltk.data.find(resource)
+            return True
+        except LookupError:
+            continue
+    return False
+
+
+def _lemmatize(word):
+    global _lemmatizer
+    if _lemmatizer is None:
+        if wordnet_available():
+            from nltk.stem import WordNetLemmatizer
+            _lemmatizer = WordNetLemmatizer().lemmatize
+        else:
+            log.warning("WordNet corpus not found, -strongs will only match exact words. "
+                        "Install it with: python -m nltk.downloader wordnet")
+            # Without WordNet every word is its own lemma
+            _lemmatizer = str
+    return _lemmatizer(word)
+
+
+def _ping():
+    return os.getpid()
+
+
+@lru_cache(maxsize=8192)
+def lemmatize_word(word):
+    """
+    Memoized WordNet lemmatization so repeated words only hit WordNet once.
+    """
+    return _lemmatize(word)
+
+
+def find_strongs(word):
+    """
+    Find the Strong's number for a given word from the Greek or Hebrew dictionaries.
+    Uses lemmatization as a fallback if no direct match is found.
+    """
+    word = lexicon.normalize_term(word)
+    if not word:
+        return None
+
+    # Direct match against the precomputed lemma/kjv_def index
+    strongs_num = _word_index.get(word)
+    if strongs_num:
+        return strongs_num
+
+    # If no match, retry with the lemmatized word
+    lemma = lemmatize_word(word)
+    if lemma != word:
+        return _word_index.get(lemma)
+
+    # No match found
+    return None
+
+
+def strongs_tags(verse_text):
+    """
+    Heuristic Strong's tags for a verse: {word position: [numbers]}, positions
+    counting whitespace-separated words from 0.
+    """
+    tags = {}
+    for position, word in enumerate(verse_text.split()):
+        # Remove punctuation and lowercase for matching
+        strongs_num = find_strongs(word.strip(",.?!;:\"'[]()").lower())
+        if strongs_num:
+            tags[position] = [strongs_num]
+    return tags
+
+
+def render_annotated(verse_text, tags):
+    """
+    Append clickable Strong's links after the tagged words of a verse.
+    `tags` maps word positions to lists of numbers, see strongs_tags().
+    """
+    annotated_words = []
+    for position, word in enumerate(verse_text.split()):
+        numbers = tags.get(position)
+        if numbers:
+            links = ", ".join(
+                f"[{number}](https://www.blueletterbible.org/lexicon/{number}/kjv/\u200b)" for number in numbers
+            )
+            annotated_words.append(f"{word} ({links})")
+        else:
+            annotated_words.append(word)
+    return " ".join(annotated_words)
+
+
+def annotate_with_strongs(verse_text):
+    """
+    Annotate the given verse text with Strong's numbers and make them clickable links.
+    """
+    return render_annotated(verse_text, strongs_tags(verse_text))
+
+
+def annotate_verses(verse_texts):
+    """
+    Job: annotate a whole list of verses in one round trip to the pool.
+    """
+    return [annotate_with_strongs(text) for text in verse_texts]
+
+
+def format_search_result(number):
+    """
+    Render a single !strongs search hit.
+    """
+    entry = (_strongs_greek if number.startswith('G') else _strongs_hebrew)[number]
+    return (
+        f"**[{number}](https://www.blueletterbible.org/lexicon/{number}/kjv/\u200b)**\n"
+        f"**Lemma**: {entry.get('lemma', 'N/A')}\n"
+        f"**Transliteration**: {entry.get('translit') or entry.get('xlit', 'N/A')}\n"
+        f"**Definition**: {entry.get('strongs_def', 'N/A')}\n"
+        f"**Derivation**: {entry.get('derivation', 'N/A')}\n"
+        f"**KJV Definition**: {entry.get('kjv_def', 'N/A')}\n"
+    )
+
+
+def search(keyword, languages=None, limit=10):
+    """
+    Job: ranked search returning (total hits, formatted top `limit` results).
+    """
+    total, numbers = _search_index.search(keyword, languages=languages, limit=limit)
+    # Only the hits we actually send get formatted
+    return total, [format_search_result(number) for number in numbers]
+
+
+class WorkerPool:
+    def __init__(self, workers=DEFAULT_WORKERS, max_pending=DEFAULT_MAX_PENDING, timeout=DEFAULT_TIMEOUT):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                 mp_context=multiprocessing.get_context(START_METHOD))
+        return self._executor
+
+    def _discard_broken(self, executor):
+        # A worker died (or its initializer failed): the executor is unusable,
+        # so the next job starts a fresh one instead of failing forever
+        if self._executor is executor:
+            log.warning("Worker pool broke, it will be restarted on the next job")
+            registry.inc("bot_worker_pool_restarts_total")
+            self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, fn, *args):
+        executor = self._get_executor()
+        try:
+            return executor, executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._discard_broken(executor)
+            executor = self._get_executor()
+            return executor, executor.submit(fn, *args)
+
+    def _job_done(self, future):
+        # Runs on the executor's thread once the job really finishes (or is cancelled)
+        with self._lock:
+            self._pending -= 1
+
+    @property
+    def pending(self):
+        return self._pending
+
+    async def submit(self, fn, *args, timeout=None):
+        """
+        Run fn(*args) in a worker process and await its result.
+
+        Raises WorkerPoolBusy when saturated and asyncio.TimeoutError if the
+        job takes longer than `timeout` seconds.
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                registry.inc("bot_worker_rejected_total", job=fn.__name__)
+                raise WorkerPoolBusy()
+            self._pending += 1
+
+        try:
+            executor, future = self._submit(fn, *args)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        future.add_done_callback(self._job_done)
+
+        try:
+            with registry.timer("bot_worker_job_seconds", job=fn.__name__):
+                return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            registry.inc("bot_worker_timeouts_total", job=fn.__name__)
+            raise
+        except BrokenProcessPool:
+            self._discard_broken(executor)
+            raise
+
+    async def warm_up(self):
+        """
+        Start every worker process so the lexicon is loaded before the first request.
+        """
+        executor, future = self._submit(_ping)
+        futures = [asyncio.wrap_future(future)]
+        futures += [asyncio.wrap_future(executor.submit(_ping)) for _ in range(self.workers - 1)]
+        try:
+            await asyncio.gather(*futures)
+        except BrokenProcessPool:
+            self._discard_broken(executor)
+            raise
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None